@@ -5,10 +5,20 @@ GUI Configuration Tool for Battery Power Monitor
 
 import gi
 gi.require_version('Gtk', '3.0')
-from gi.repository import Gtk
+from gi.repository import Gtk, GLib
 import json
 from pathlib import Path
 
+from script_loader import load_script
+
+def load_monitor():
+    """The monitor module for live readings, or None if it cannot be loaded"""
+    try:
+        return load_script("battery-power-monitor.py", "battery-power-monitor")
+    except Exception as e:
+        print(f"Could not load monitor for live readings: {e}")
+        return None
+
 class ConfigWindow(Gtk.Window):
     def __init__(self):
         super().__init__(title="Battery Power Monitor Settings")
@@ -17,6 +27,9 @@ class ConfigWindow(Gtk.Window):
         
         self.config_file = Path.home() / ".config" / "battery-power-monitor.json"
         self.config = self.load_config()
+        self.monitor = load_monitor()
+        self.sampler = None
+        self.connect("destroy", self.on_destroy)
         
         # Create notebook for tabs
         notebook = Gtk.Notebook()
@@ -42,7 +55,7 @@ class ConfigWindow(Gtk.Window):
         button_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
         button_box.set_halign(Gtk.Align.END)
         
-        save_btn = Gtk.Button(label="Save & Restart")
+        save_btn = Gtk.Button(label="Save")
         save_btn.connect("clicked", self.on_save)
         button_box.pack_start(save_btn, False, False, 0)
         
@@ -72,18 +85,94 @@ class ConfigWindow(Gtk.Window):
         self.interval_spin = Gtk.SpinButton()
         self.interval_spin.set_range(0.5, 10)
         self.interval_spin.set_increments(0.5, 1)
+        self.interval_spin.set_digits(1)
         self.interval_spin.set_value(self.config.get('update_interval', 1))
         interval_box.pack_start(self.interval_spin, False, False, 0)
         box.pack_start(interval_box, False, False, 0)
         
+        # Redraw interval
+        ui_interval_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
+        ui_interval_box.pack_start(Gtk.Label(label="Redraw Panel At Most Every (seconds):"), False, False, 0)
+        self.ui_interval_spin = Gtk.SpinButton()
+        self.ui_interval_spin.set_range(0.5, 10)
+        self.ui_interval_spin.set_increments(0.5, 1)
+        self.ui_interval_spin.set_digits(1)
+        self.ui_interval_spin.set_value(self.config.get('ui_interval', 1))
+        ui_interval_box.pack_start(self.ui_interval_spin, False, False, 0)
+        box.pack_start(ui_interval_box, False, False, 0)
+        
+        # Adaptive polling
+        adaptive_config = self.config.get('adaptive_polling', {})
+        self.adaptive_enabled = Gtk.CheckButton(label="Poll less often while readings are stable or idle")
+        self.adaptive_enabled.set_active(adaptive_config.get('enabled', True))
+        box.pack_start(self.adaptive_enabled, False, False, 0)
+        
+        adaptive_grid = Gtk.Grid()
+        adaptive_grid.set_column_spacing(6)
+        adaptive_grid.set_row_spacing(6)
+        adaptive_grid.set_margin_left(20)
+        
+        adaptive_grid.attach(Gtk.Label(label="Maximum interval (seconds):"), 0, 0, 1, 1)
+        self.max_interval_spin = Gtk.SpinButton()
+        self.max_interval_spin.set_range(1, 60)
+        self.max_interval_spin.set_increments(1, 5)
+        self.max_interval_spin.set_value(adaptive_config.get('max_interval', 5.0))
+        adaptive_grid.attach(self.max_interval_spin, 1, 0, 1, 1)
+        
+        adaptive_grid.attach(Gtk.Label(label="Backoff factor:"), 0, 1, 1, 1)
+        self.backoff_spin = Gtk.SpinButton()
+        self.backoff_spin.set_range(1, 4)
+        self.backoff_spin.set_increments(0.1, 0.5)
+        self.backoff_spin.set_digits(1)
+        self.backoff_spin.set_value(adaptive_config.get('backoff', 1.5))
+        adaptive_grid.attach(self.backoff_spin, 1, 1, 1, 1)
+        
+        adaptive_grid.attach(Gtk.Label(label="Change threshold (W):"), 0, 2, 1, 1)
+        self.change_threshold_spin = Gtk.SpinButton()
+        self.change_threshold_spin.set_range(0.1, 20)
+        self.change_threshold_spin.set_increments(0.1, 1)
+        self.change_threshold_spin.set_digits(1)
+        self.change_threshold_spin.set_value(adaptive_config.get('change_threshold', 1.0))
+        adaptive_grid.attach(self.change_threshold_spin, 1, 2, 1, 1)
+        
+        box.pack_start(adaptive_grid, False, False, 0)
+        
+        self.uevents_check = Gtk.CheckButton(label="Refresh immediately on power supply events")
+        self.uevents_check.set_active(self.config.get('watch_uevents', True))
+        box.pack_start(self.uevents_check, False, False, 0)
+        
+        self.instrumentation_check = Gtk.CheckButton(label="Measure the monitor's own overhead (Diagnostics menu)")
+        self.instrumentation_check.set_active(self.config.get('instrumentation', False))
+        box.pack_start(self.instrumentation_check, False, False, 0)
+        
+        self.attribution_check = Gtk.CheckButton(label="Estimate which processes use the power (Top Processes menu)")
+        self.attribution_check.set_active(self.config.get('process_attribution', {}).get('enabled', False))
+        box.pack_start(self.attribution_check, False, False, 0)
+        
+        self.energy_check = Gtk.CheckButton(label="Count watt-hours per session, day and discharge cycle")
+        self.energy_check.set_active(self.config.get('energy_accounting', {}).get('enabled', True))
+        box.pack_start(self.energy_check, False, False, 0)
+        
         # Battery device
         device_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
         device_box.pack_start(Gtk.Label(label="Battery Device:"), False, False, 0)
-        self.device_entry = Gtk.Entry()
-        self.device_entry.set_text(self.config.get('battery_device', 'BAT1'))
-        device_box.pack_start(self.device_entry, True, True, 0)
+        self.device_combo = Gtk.ComboBoxText.new_with_entry()
+        self.device_combo.append("auto", "auto")
+        if self.monitor is not None:
+            for name, kind in self.monitor.discover_power_supplies().items():
+                if kind == "Battery":
+                    self.device_combo.append(name, name)
+        self.device_combo.get_child().set_text(self.config.get('battery_device', 'auto'))
+        self.device_combo.connect("changed", self.on_device_changed)
+        device_box.pack_start(self.device_combo, True, True, 0)
         box.pack_start(device_box, False, False, 0)
         
+        # Live reading of the selected device
+        self.reading_label = Gtk.Label(label="Reading: --", xalign=0)
+        box.pack_start(self.reading_label, False, False, 0)
+        self.on_device_changed(self.device_combo)
+        GLib.timeout_add_seconds(1, self.update_reading)
+        
         # Decimal places
         decimal_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
         decimal_box.pack_start(Gtk.Label(label="Decimal Places:"), False, False, 0)
@@ -106,6 +195,7 @@ class ConfigWindow(Gtk.Window):
         self.format_combo = Gtk.ComboBoxText()
         self.format_combo.append("short", "Short (5.23W)")
         self.format_combo.append("detailed", "Detailed (Power: 5.23W)")
+        self.format_combo.append("smoothed", "Smoothed 10s average (~5.23W)")
         self.format_combo.set_active_id(self.config.get('display_format', 'short'))
         format_box.pack_start(self.format_combo, False, False, 0)
         box.pack_start(format_box, False, False, 0)
@@ -122,6 +212,21 @@ class ConfigWindow(Gtk.Window):
         icon_box.pack_start(self.icon_combo, False, False, 0)
         box.pack_start(icon_box, False, False, 0)
         
+        # Label hysteresis
+        hysteresis_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
+        hysteresis_box.pack_start(Gtk.Label(label="Label Hysteresis (W):"), False, False, 0)
+        self.hysteresis_spin = Gtk.SpinButton()
+        self.hysteresis_spin.set_range(0, 5)
+        self.hysteresis_spin.set_increments(0.01, 0.1)
+        self.hysteresis_spin.set_digits(2)
+        self.hysteresis_spin.set_value(self.config.get('label_hysteresis', 0.0))
+        hysteresis_box.pack_start(self.hysteresis_spin, False, False, 0)
+        box.pack_start(hysteresis_box, False, False, 0)
+        
+        self.label_time_estimate = Gtk.CheckButton(label="Show time to empty / full in the panel")
+        self.label_time_estimate.set_active(self.config.get('label_time_estimate', False))
+        box.pack_start(self.label_time_estimate, False, False, 0)
+        
         # Color coding
         box.pack_start(Gtk.Label(label="Color Coding:", xalign=0), False, False, 0)
         
@@ -193,8 +298,112 @@ class ConfigWindow(Gtk.Window):
         
         box.pack_start(notify_grid, False, False, 0)
         
+        # Alert rules
+        box.pack_start(Gtk.Label(label="Alert Rules:", xalign=0), False, False, 0)
+        
+        self.rules_grid = Gtk.Grid()
+        self.rules_grid.set_column_spacing(6)
+        self.rules_grid.set_row_spacing(6)
+        for column, title in enumerate(["On", "Name", "Metric", "", "Value", "For (s)",
+                                        "While", "Cooldown (s)"]):
+            self.rules_grid.attach(Gtk.Label(label=title, xalign=0), column, 0, 1, 1)
+        
+        self.rule_rows = []
+        rules = self.config.get('alert_rules')
+        if rules is None:
+            rules = self.monitor.CONFIG['alert_rules'] if self.monitor is not None else []
+        for rule in rules:
+            self.add_rule_row(rule)
+        
+        scrolled = Gtk.ScrolledWindow()
+        scrolled.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
+        scrolled.add(self.rules_grid)
+        box.pack_start(scrolled, True, True, 0)
+        
+        add_btn = Gtk.Button(label="Add Rule")
+        add_btn.set_halign(Gtk.Align.START)
+        add_btn.connect("clicked", lambda widget: self.add_rule_row({}))
+        box.pack_start(add_btn, False, False, 0)
+        
         return box
     
+    def add_rule_row(self, rule):
+        row = {}
+        top = len(self.rule_rows) + 1
+        
+        row['enabled'] = Gtk.CheckButton()
+        row['enabled'].set_active(rule.get('enabled', True))
+        
+        row['name'] = Gtk.Entry()
+        row['name'].set_width_chars(16)
+        row['name'].set_text(rule.get('name', "Battery Alert"))
+        
+        row['metric'] = Gtk.ComboBoxText()
+        row['metric'].append("power", "Power (W)")
+        row['metric'].append("power_avg", "1 min average (W)")
+        row['metric'].append("capacity", "Capacity (%)")
+        row['metric'].set_active_id(rule.get('metric', "power"))
+        
+        row['condition'] = Gtk.ComboBoxText()
+        row['condition'].append(">", "above")
+        row['condition'].append("<", "below")
+        row['condition'].set_active_id(rule.get('condition', ">"))
+        
+        row['value'] = Gtk.SpinButton()
+        row['value'].set_range(0, 200)
+        row['value'].set_increments(1, 5)
+        row['value'].set_digits(1)
+        row['value'].set_value(rule.get('value', 30.0))
+        
+        row['duration'] = Gtk.SpinButton()
+        row['duration'].set_range(0, 3600)
+        row['duration'].set_increments(10, 60)
+        row['duration'].set_value(rule.get('duration', 0))
+        
+        row['status'] = Gtk.ComboBoxText()
+        row['status'].append("any", "Any status")
+        row['status'].append("Discharging", "Discharging")
+        row['status'].append("Charging", "Charging")
+        row['status'].set_active_id(rule.get('status') or "any")
+        
+        row['cooldown'] = Gtk.SpinButton()
+        row['cooldown'].set_range(0, 86400)
+        row['cooldown'].set_increments(60, 300)
+        row['cooldown'].set_value(rule.get('cooldown', 300))
+        
+        remove_btn = Gtk.Button(label="Remove")
+        remove_btn.connect("clicked", self.on_remove_rule, row)
+        
+        widgets = [row['enabled'], row['name'], row['metric'], row['condition'], row['value'],
+                   row['duration'], row['status'], row['cooldown'], remove_btn]
+        for column, widget in enumerate(widgets):
+            self.rules_grid.attach(widget, column, top, 1, 1)
+        row['widgets'] = widgets
+        
+        self.rule_rows.append(row)
+        self.rules_grid.show_all()
+    
+    def on_remove_rule(self, widget, row):
+        for child in row['widgets']:
+            self.rules_grid.remove(child)
+        self.rule_rows.remove(row)
+    
+    def get_alert_rules(self):
+        rules = []
+        for row in self.rule_rows:
+            status = row['status'].get_active_id()
+            rules.append({
+                "enabled": row['enabled'].get_active(),
+                "name": row['name'].get_text(),
+                "metric": row['metric'].get_active_id(),
+                "condition": row['condition'].get_active_id(),
+                "value": row['value'].get_value(),
+                "duration": int(row['duration'].get_value()),
+                "status": None if status == "any" else status,
+                "cooldown": int(row['cooldown'].get_value())
+            })
+        return rules
+    
     def create_menu_tab(self):
         box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=12)
         box.set_border_width(12)
@@ -217,15 +426,75 @@ class ConfigWindow(Gtk.Window):
         self.show_capacity.set_active(self.config.get('show_capacity', True))
         box.pack_start(self.show_capacity, False, False, 0)
         
+        self.show_time_estimate = Gtk.CheckButton(label="Time to Empty / Full")
+        self.show_time_estimate.set_active(self.config.get('show_time_estimate', True))
+        box.pack_start(self.show_time_estimate, False, False, 0)
+        
+        self.show_batteries = Gtk.CheckButton(label="Per-Battery Breakdown and AC Adapter")
+        self.show_batteries.set_active(self.config.get('show_batteries', True))
+        box.pack_start(self.show_batteries, False, False, 0)
+        
+        self.show_statistics = Gtk.CheckButton(label="Averages, Min/Max and 95th Percentile")
+        self.show_statistics.set_active(self.config.get('show_statistics', True))
+        box.pack_start(self.show_statistics, False, False, 0)
+        
+        self.show_graph = Gtk.CheckButton(label="Power Graphs (1, 10 and 60 minutes)")
+        self.show_graph.set_active(self.config.get('show_graph', True))
+        box.pack_start(self.show_graph, False, False, 0)
+        
         return box
     
+    def on_device_changed(self, widget):
+        if self.monitor is None:
+            return
+        
+        if self.sampler is not None:
+            self.sampler.close()
+        device = widget.get_active_text()
+        if device == "auto":
+            supplies = self.monitor.discover_power_supplies()
+            self.sampler = self.monitor.SupplyGroupSampler(self.monitor.POWER_SUPPLY_ROOT, supplies)
+        else:
+            self.sampler = self.monitor.BatterySampler(f"{self.monitor.POWER_SUPPLY_ROOT}/{device}")
+        self.update_reading()
+    
+    def update_reading(self):
+        if self.sampler is None:
+            return False
+        
+        snapshot = self.sampler.sample()
+        if snapshot.power is None:
+            self.reading_label.set_text("Reading: device not readable")
+        else:
+            self.reading_label.set_text(f"Reading: {snapshot.watts:.2f} W ({snapshot.status or 'Unknown'})")
+        return True
+    
     def on_save(self, widget):
         # Build config
         config = {
             "update_interval": self.interval_spin.get_value(),
-            "battery_device": self.device_entry.get_text(),
+            "ui_interval": self.ui_interval_spin.get_value(),
+            "adaptive_polling": {
+                "enabled": self.adaptive_enabled.get_active(),
+                "max_interval": self.max_interval_spin.get_value(),
+                "backoff": self.backoff_spin.get_value(),
+                "change_threshold": self.change_threshold_spin.get_value()
+            },
+            "watch_uevents": self.uevents_check.get_active(),
+            "instrumentation": self.instrumentation_check.get_active(),
+            "process_attribution": {
+                **self.config.get('process_attribution', {}),
+                "enabled": self.attribution_check.get_active()
+            },
+            "energy_accounting": {
+                **self.config.get('energy_accounting', {}),
+                "enabled": self.energy_check.get_active()
+            },
+            "battery_device": self.device_combo.get_active_text(),
             "display_format": self.format_combo.get_active_id(),
             "decimal_places": int(self.decimal_spin.get_value()),
+            "label_hysteresis": self.hysteresis_spin.get_value(),
+            "label_time_estimate": self.label_time_estimate.get_active(),
             "color_coding": {
                 "enabled": self.color_enabled.get_active(),
                 "low": self.low_spin.get_value(),
@@ -238,16 +507,28 @@ class ConfigWindow(Gtk.Window):
                 "threshold": self.notify_threshold.get_value(),
                 "cooldown": int(self.notify_cooldown.get_value())
             },
+            "alert_rules": self.get_alert_rules(),
             "show_voltage": self.show_voltage.get_active(),
             "show_current": self.show_current.get_active(),
             "show_battery_status": self.show_status.get_active(),
-            "show_capacity": self.show_capacity.get_active()
+            "show_capacity": self.show_capacity.get_active(),
+            "show_statistics": self.show_statistics.get_active(),
+            "show_graph": self.show_graph.get_active(),
+            "show_batteries": self.show_batteries.get_active(),
+            "show_time_estimate": self.show_time_estimate.get_active()
         }
         
+        # Keep settings that have no widget here (e.g. power_log)
+        config = {**self.config, **config}
+        
         # Save config
         with open(self.config_file, 'w') as f:
             json.dump(config, f, indent=4)
         
+        # Apply it right away if the monitor is running
+        if self.monitor is not None:
+            self.monitor.send_command("reload")
+        
         # Show success dialog
         dialog = Gtk.MessageDialog(
             transient_for=self,
@@ -257,8 +538,7 @@ class ConfigWindow(Gtk.Window):
             text="Settings Saved!"
         )
         dialog.format_secondary_text(
-            "Please restart the battery monitor for changes to take effect.\n\n"
-            "Run: pkill -f battery-power-monitor && ~/.local/bin/battery-power-monitor &"
+            "The running battery monitor picks up the changes automatically."
         )
         dialog.run()
         dialog.destroy()
@@ -267,6 +547,11 @@ class ConfigWindow(Gtk.Window):
     
     def on_cancel(self, widget):
         self.close()
+    
+    def on_destroy(self, widget):
+        if self.sampler is not None:
+            self.sampler.close()
+            self.sampler = None
 
 def main():
     win = ConfigWindow()
@@ -4,28 +4,65 @@ Battery Power Monitor for MATE Desktop
 Configurable system tray indicator showing real-time power consumption
 """
 
-import gi
-gi.require_version('Gtk', '3.0')
-gi.require_version('AppIndicator3', '0.1')
-from gi.repository import Gtk, AppIndicator3, GLib
+import copy
+import errno
+import fcntl
+import heapq
 import json
+import math
+import mmap
 import os
+import queue
+import selectors
+import signal
+import socket
+import stat
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
 from pathlib import Path
 
 # ============= CONFIGURATION =============
 CONFIG = {
-    # Update interval in seconds
+    # Update interval in seconds (the fastest rate when polling adaptively)
     "update_interval": 1,
     
-    # Battery device (BAT0, BAT1, etc.)
-    "battery_device": "BAT1",
+    # High-rate capture started from the menu (--capture and the control
+    # socket can ask for other values)
+    "capture": {
+        "duration": 30,    # Seconds
+        "rate": 50         # Samples per second
+    },
+    
+    # Minimum seconds between panel and menu redraws; readings taken in
+    # between still go into history, statistics and the power log
+    "ui_interval": 1,
+    
+    # Slow down polling while readings are stable or the session is idle
+    "adaptive_polling": {
+        "enabled": True,
+        "max_interval": 5.0,       # Ceiling for the interval (seconds)
+        "backoff": 1.5,            # Interval multiplier per stable reading
+        "change_threshold": 1.0    # Power change (W) that restores update_interval
+    },
+    
+    # Battery device (BAT0, BAT1, etc.), or "auto" to sum every battery
+    "battery_device": "auto",
     
-    # Display format: "short" shows "5.23W", "detailed" shows "Power: 5.23W"
+    # Display format: "short" shows "5.23W", "detailed" shows "Power: 5.23W",
+    # "smoothed" shows the 10 second moving average as "~5.23W"
     "display_format": "short",
     
     # Decimal places for power reading
     "decimal_places": 2,
     
+    # Keep the panel label until power moves more than this (watts);
+    # 0 redraws on any visible change
+    "label_hysteresis": 0.0,
+    
     # Color coding thresholds (watts)
     "color_coding": {
         "enabled": True,
@@ -34,6 +71,50 @@ CONFIG = {
         "high": 25.0     # Orange between medium and high, red above
     },
     
+    # Number of samples kept in memory (86400 is 24 h at 1 s, ~3 MB)
+    "history_size": 86400,
+    
+    # Append every reading to a compact binary log under
+    # ~/.local/share/battery-power-monitor/ (16 bytes per sample)
+    "power_log": {
+        "enabled": False,
+        "flush_interval": 60,      # Seconds between batched writes
+        "fsync_interval": 600,     # Seconds between fsyncs
+        "segment_mb": 4,           # Start a new segment at this size...
+        "segment_hours": 24,       # ...or this age
+        "keep_days": 365           # Delete segments older than this
+    },
+    
+    # Refresh as soon as the kernel reports a power supply change
+    # (AC plugged, charge finished, capacity step) instead of on the next poll
+    "watch_uevents": True,
+    
+    # Estimate each process's share of the power draw from its CPU time
+    # (and RAPL package power where readable), for the menu and alerts
+    "process_attribution": {
+        "enabled": False,
+        "interval": 5,             # Seconds between /proc scans (on a worker thread)
+        "top": 5                   # Processes listed in the menu
+    },
+    
+    # Watt-hours used per session, calendar day and discharge cycle, for the
+    # menu and --command energy; the totals survive restarts
+    "energy_accounting": {
+        "enabled": True,
+        "checkpoint_interval": 300   # Seconds between saves of the totals
+    },
+    
+    # Measure the monitor's own cost (tick latency, CPU, wakeups, memory)
+    # for the Diagnostics menu and --command diagnostics
+    "instrumentation": False,
+    
+    # HTTP endpoint of the headless daemon (--headless): Prometheus text on
+    # /metrics and JSON on /json. Keep it on localhost.
+    "metrics": {
+        "address": "127.0.0.1",
+        "port": 9756
+    },
+    
     # Icon style: "battery", "power", "bolt", "chip"
     "icon_style": "battery",
     
@@ -44,110 +125,2727 @@ CONFIG = {
         "cooldown": 300  # seconds between notifications
     },
     
+    # Alert rules: notify when metric ("power", "power_avg" for the 1 minute
+    # average, or "capacity") is above (">") or below ("<") value for
+    # duration seconds, optionally only while status matches
+    "alert_rules": [
+        {"enabled": False, "name": "Sustained High Power", "metric": "power", "condition": ">",
+         "value": 25.0, "duration": 60, "status": None, "cooldown": 600},
+        {"enabled": False, "name": "Low Battery", "metric": "capacity", "condition": "<",
+         "value": 15, "duration": 0, "status": "Discharging", "cooldown": 900},
+        {"enabled": False, "name": "Slow Charging", "metric": "power", "condition": "<",
+         "value": 10.0, "duration": 120, "status": "Charging", "cooldown": 1800}
+    ],
+    
     # Menu options
     "show_voltage": True,
     "show_current": True,
     "show_battery_status": True,
-    "show_capacity": True
+    "show_capacity": True,
+    "show_statistics": True,
+    "show_graph": True,            # Power graphs of the last 1, 10 and 60 minutes
+    "show_batteries": True,        # Per-battery breakdown and AC adapter state
+    "show_time_estimate": True,    # Time to empty / full in the menu
+    "label_time_estimate": False   # Also append it to the panel label ("5.23W 3:25")
+}
+
+# The GTK bindings take longer to import than everything else put together,
+# so load_gtk() imports them only for the tray indicator; the sampler and
+# the headless daemon work without them (test-battery.py loads this file)
+Gtk = AppIndicator3 = GLib = Gio = GdkPixbuf = None
+
+def load_gtk():
+    """Import the GTK bindings, returning False if they are not installed"""
+    global Gtk, AppIndicator3, GLib, Gio, GdkPixbuf
+    if Gtk is not None:
+        return True
+    try:
+        import gi
+        gi.require_version('Gtk', '3.0')
+        gi.require_version('AppIndicator3', '0.1')
+        gi.require_version('GdkPixbuf', '2.0')
+        from gi.repository import Gtk, AppIndicator3, GLib, Gio, GdkPixbuf
+    except (ImportError, ValueError):
+        return False
+    return True
+
+# BATTERY_POWER_SUPPLY_ROOT (or --sysfs-root) points the monitor at another
+# tree, e.g. one made by fake-battery.py
+POWER_SUPPLY_ROOT = os.environ.get("BATTERY_POWER_SUPPLY_ROOT", "/sys/class/power_supply")
+CONFIG_FILE = Path.home() / ".config" / "battery-power-monitor.json"
+
+def merge_config(user_config):
+    """Defaults overlaid with user settings (sections are merged key by key)"""
+    config = copy.deepcopy(CONFIG)
+    for key, value in user_config.items():
+        if isinstance(config.get(key), dict) and isinstance(value, dict):
+            config[key].update(value)
+        else:
+            config[key] = value
+    return config
+
+# (lowest, highest) allowed value of numeric settings; None is unbounded.
+# Each of these either divides, sizes a buffer or paces a loop.
+CONFIG_LIMITS = {
+    "update_interval": (0.1, None),
+    "ui_interval": (0, None),
+    "capture.duration": (0.1, None),
+    "capture.rate": (1, 1000),
+    "adaptive_polling.max_interval": (0.1, None),
+    "adaptive_polling.backoff": (1, None),
+    "adaptive_polling.change_threshold": (0, None),
+    "decimal_places": (0, 6),
+    "label_hysteresis": (0, None),
+    "history_size": (1, None),
+    "power_log.flush_interval": (1, None),
+    "power_log.fsync_interval": (1, None),
+    "power_log.segment_mb": (0.1, None),
+    "power_log.segment_hours": (0.1, None),
+    "power_log.keep_days": (0.1, None),
+    "process_attribution.interval": (0.5, None),
+    "process_attribution.top": (1, 50),
+    "energy_accounting.checkpoint_interval": (1, None),
+    "metrics.port": (0, 65535),
+    "notify_high_power.cooldown": (0, None),
 }
 
-class BatteryPowerMonitor:
+# Settings used as counts, which must be whole numbers
+CONFIG_INTEGERS = {"decimal_places", "history_size", "process_attribution.top", "metrics.port"}
+
+def check_limits(key, value):
+    """The problem with a numeric setting's value, or None"""
+    if key in CONFIG_INTEGERS and not isinstance(value, int):
+        return f"{key} should be a whole number, not {value!r}"
+    low, high = CONFIG_LIMITS.get(key, (None, None))
+    if low is not None and value < low:
+        return f"{key} should be at least {low}, not {value!r}"
+    if high is not None and value > high:
+        return f"{key} should be at most {high}, not {value!r}"
+    return None
+
+def validate_config(config, defaults=CONFIG, prefix=""):
+    """Return a list of problems with a merged config (empty if valid)"""
+    problems = []
+    if not prefix:
+        for index, rule in enumerate(config.get('alert_rules') or ()):
+            if not isinstance(rule, dict):
+                problems.append(f"alert_rules[{index}] should be an object, not {rule!r}")
+            else:
+                problems += AlertRule.config_problems(rule, f"alert_rules[{index}]")
+    
+    for key, default in defaults.items():
+        value = config.get(key)
+        if isinstance(default, bool):
+            valid = isinstance(value, bool)
+        elif isinstance(default, (int, float)):
+            valid = isinstance(value, (int, float)) and not isinstance(value, bool)
+        elif isinstance(default, dict):
+            valid = isinstance(value, dict)
+            if valid:
+                problems += validate_config(value, default, f"{prefix}{key}.")
+        else:
+            valid = isinstance(value, type(default))
+        
+        if not valid:
+            expected = "number" if type(default) in (int, float) else type(default).__name__
+            problems.append(f"{prefix}{key} should be {expected}, not {value!r}")
+        elif isinstance(default, (int, float)) and not isinstance(default, bool):
+            problem = check_limits(prefix + key, value)
+            if problem is not None:
+                problems.append(problem)
+    return problems
+
+class PowerSnapshot:
+    """One coherent set of battery readings, taken once per tick.
+    
+    Raw units as reported by sysfs: µV, µA and µW; timestamp is wall time.
+    Totals over several batteries carry the per-battery snapshots in packs
+    as (name, snapshot) pairs, and whether an AC adapter is online.
+    """
+    
+    __slots__ = ("timestamp", "voltage", "current", "power", "status", "capacity",
+                 "packs", "ac_online", "energy", "energy_full")
+    
+    def __init__(self, timestamp, voltage, current, power, status, capacity,
+                 packs=(), ac_online=None, energy=None, energy_full=None):
+        self.timestamp = timestamp
+        self.voltage = voltage
+        self.current = current
+        self.power = power
+        self.status = status
+        self.capacity = capacity
+        self.packs = packs
+        self.ac_online = ac_online
+        
+        # Remaining and full energy in µWh, when read (see read_energy)
+        self.energy = energy
+        self.energy_full = energy_full
+    
+    @property
+    def watts(self):
+        """Power draw in watts, or None if it could not be read"""
+        if self.power is None:
+            return None
+        return self.power / 1_000_000
+
+# Compact codes for the sysfs status strings
+STATUS_CODES = {"Unknown": 0, "Charging": 1, "Discharging": 2, "Not charging": 3, "Full": 4}
+STATUS_NAMES = {code: name for name, code in STATUS_CODES.items()}
+
+class PowerHistory:
+    """Fixed-capacity ring buffer of samples stored in typed array columns.
+    
+    Appending is O(1) and never allocates; samples are not kept as Python
+    objects, so 24 h at 1 Hz stays around 3 MB. Window queries locate their
+    range by binary search on the timestamp column and reduce it with
+    C-level min/max/sum over array slices.
+    """
+    
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.timestamps = array('d', bytes(8 * capacity))
+        self.power = array('q', bytes(8 * capacity))
+        self.voltage = array('q', bytes(8 * capacity))
+        self.current = array('q', bytes(8 * capacity))
+        self.capacity_pct = array('b', bytes(capacity))
+        self.status = array('b', bytes(capacity))
+        self.head = 0
+        self.count = 0
+        
+        # Samples appended so far; sample number n lives at n % capacity
+        # until it is overwritten
+        self.total = 0
+    
+    def __len__(self):
+        return self.count
+    
+    def append(self, snapshot):
+        """Store a snapshot; readings without power are skipped"""
+        if snapshot.power is None:
+            return
+        
+        i = self.head
+        self.timestamps[i] = snapshot.timestamp
+        self.power[i] = snapshot.power
+        self.voltage[i] = snapshot.voltage or 0
+        self.current[i] = snapshot.current or 0
+        self.capacity_pct[i] = snapshot.capacity if snapshot.capacity is not None else -1
+        self.status[i] = STATUS_CODES.get(snapshot.status, 0)
+        
+        self.head = (i + 1) % self.capacity
+        self.total += 1
+        if self.count < self.capacity:
+            self.count += 1
+    
+    def index(self, n):
+        """Physical index of the n-th oldest sample"""
+        return (self.head - self.count + n) % self.capacity
+    
+    def timestamp_at(self, n):
+        return self.timestamps[self.index(n)]
+    
+    def find(self, timestamp):
+        """Logical index of the first sample at or after timestamp"""
+        lo, hi = 0, self.count
+        start = self.head - self.count
+        if start >= 0:
+            # Contiguous: search the array directly
+            return bisect_left(self.timestamps, timestamp, start, self.head) - start
+        
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.timestamps[(start + mid) % self.capacity] < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+    
+    def column(self, name, seconds=None, now=None):
+        """Return a column's values for the last seconds (all if None)"""
+        data = getattr(self, name)
+        first = 0
+        if seconds is not None and self.count:
+            if now is None:
+                now = self.timestamp_at(self.count - 1)
+            first = self.find(now - seconds)
+        
+        start = self.index(first)
+        length = self.count - first
+        if length <= 0:
+            return data[0:0]
+        end = start + length
+        if end <= self.capacity:
+            return data[start:end]
+        return data[start:] + data[:end - self.capacity]
+    
+    def stats(self, seconds=None, now=None):
+        """Return (min, max, mean) power in watts over the window, or None"""
+        values = self.column('power', seconds, now)
+        if not values:
+            return None
+        return (min(values) / 1_000_000, max(values) / 1_000_000,
+                sum(values) / len(values) / 1_000_000)
+    
+    def latest(self):
+        """Timestamp and power (µW) of the newest sample, or None"""
+        if not self.count:
+            return None
+        i = self.index(self.count - 1)
+        return self.timestamps[i], self.power[i]
+
+class RollingWindow:
+    """Min, max, mean and percentiles of power over a sliding time window.
+    
+    Works on sample numbers of a PowerHistory rather than copies of the
+    values: min and max use monotonic deques, the mean a running sum and
+    percentiles a fixed histogram, so each new sample costs amortised O(1)
+    whatever the window length.
+    """
+    
+    BIN_WIDTH = 100_000      # µW per histogram bin (0.1 W)
+    BINS = 1000              # Covers 0-100 W; larger values land in the last bin
+    
+    def __init__(self, history, seconds):
+        self.history = history
+        self.seconds = seconds
+        self.reset()
+    
+    def reset(self):
+        self.tail = self.history.total
+        self.size = 0
+        self.total = 0
+        self.mins = deque()
+        self.maxs = deque()
+        self.bins = array('l', bytes(array('l').itemsize * self.BINS))
+    
+    def bin_for(self, power):
+        return min(max(power // self.BIN_WIDTH, 0), self.BINS - 1)
+    
+    def add(self, seq):
+        history = self.history
+        power = history.power[seq % history.capacity]
+        
+        while self.mins and history.power[self.mins[-1] % history.capacity] >= power:
+            self.mins.pop()
+        self.mins.append(seq)
+        while self.maxs and history.power[self.maxs[-1] % history.capacity] <= power:
+            self.maxs.pop()
+        self.maxs.append(seq)
+        
+        self.size += 1
+        self.total += power
+        self.bins[self.bin_for(power)] += 1
+    
+    def expire(self, now):
+        history = self.history
+        cutoff = now - self.seconds
+        while self.tail < history.total:
+            i = self.tail % history.capacity
+            if history.timestamps[i] >= cutoff:
+                break
+            
+            power = history.power[i]
+            self.size -= 1
+            self.total -= power
+            self.bins[self.bin_for(power)] -= 1
+            if self.mins and self.mins[0] == self.tail:
+                self.mins.popleft()
+            if self.maxs and self.maxs[0] == self.tail:
+                self.maxs.popleft()
+            self.tail += 1
+    
+    def update(self):
+        """Account for the newest sample in the history"""
+        history = self.history
+        seq = history.total - 1
+        
+        if self.tail < history.total - history.capacity:
+            # The history overwrote samples still inside the window
+            self.reset()
+            self.tail = max(history.total - history.capacity, 0)
+            for n in range(self.tail, seq):
+                self.add(n)
+        
+        self.add(seq)
+        self.expire(history.timestamps[seq % history.capacity])
+    
+    def minimum(self):
+        """Smallest power in watts, or None if the window is empty"""
+        if not self.size:
+            return None
+        return self.history.power[self.mins[0] % self.history.capacity] / 1_000_000
+    
+    def maximum(self):
+        """Largest power in watts, or None if the window is empty"""
+        if not self.size:
+            return None
+        return self.history.power[self.maxs[0] % self.history.capacity] / 1_000_000
+    
+    def mean(self):
+        """Mean power in watts, or None if the window is empty"""
+        if not self.size:
+            return None
+        return self.total / self.size / 1_000_000
+    
+    def percentile(self, fraction):
+        """Power in watts below which the given fraction of samples fall.
+        
+        Resolved to the histogram bin width (the upper edge of the bin),
+        and kept within the window's minimum and maximum so it never
+        reports a value no sample had; None if the window is empty.
+        """
+        if not self.size:
+            return None
+        
+        rank = math.ceil(fraction * self.size)
+        seen = 0
+        value = self.BINS * self.BIN_WIDTH / 1_000_000
+        for i, count in enumerate(self.bins):
+            seen += count
+            if seen >= rank:
+                value = (i + 1) * self.BIN_WIDTH / 1_000_000
+                break
+        return min(max(value, self.minimum()), self.maximum())
+
+class RollingStats:
+    """Exponential moving averages and windowed statistics of power.
+    
+    Fed once per recorded sample; EMAs handle irregular intervals by
+    deriving the smoothing factor from the time since the previous sample.
+    """
+    
+    WINDOWS = (10, 60, 300)
+    
+    def __init__(self, history, windows=WINDOWS):
+        self.history = history
+        self.windows = {seconds: RollingWindow(history, seconds) for seconds in windows}
+        self.ema = dict.fromkeys(windows)
+        self.last_timestamp = None
+    
+    def update(self):
+        """Account for the newest sample in the history"""
+        latest = self.history.latest()
+        if latest is None:
+            return
+        
+        timestamp, power = latest
+        if timestamp == self.last_timestamp:
+            return
+        
+        watts = power / 1_000_000
+        if self.last_timestamp is None:
+            for seconds in self.ema:
+                self.ema[seconds] = watts
+        else:
+            dt = max(timestamp - self.last_timestamp, 0)
+            for seconds, value in self.ema.items():
+                alpha = 1 - math.exp(-dt / seconds)
+                self.ema[seconds] = value + alpha * (watts - value)
+        self.last_timestamp = timestamp
+        
+        for window in self.windows.values():
+            window.update()
+
+class MinMaxSeries:
+    """Lowest and highest power per time bucket over a sliding span.
+    
+    Buckets are aligned to multiples of their width and kept in a ring, so
+    adding a sample is O(1) and reading the series never touches the raw
+    history. Buckets without samples are NaN.
+    """
+    
+    def __init__(self, span, buckets):
+        self.width = span / buckets
+        self.buckets = buckets
+        self.low = array('f', [math.nan]) * buckets
+        self.high = array('f', [math.nan]) * buckets
+        self.newest = None
+    
+    def append(self, timestamp, watts):
+        bucket = int(timestamp // self.width)
+        if self.newest is None or bucket > self.newest:
+            # Clear the buckets the span has moved past, at most all of them
+            first = bucket - self.buckets + 1
+            if self.newest is not None:
+                first = max(first, self.newest + 1)
+            for skipped in range(first, bucket + 1):
+                self.low[skipped % self.buckets] = math.nan
+                self.high[skipped % self.buckets] = math.nan
+            self.newest = bucket
+        elif bucket <= self.newest - self.buckets:
+            return
+        
+        i = bucket % self.buckets
+        if not watts >= self.low[i]:
+            self.low[i] = watts
+        if not watts <= self.high[i]:
+            self.high[i] = watts
+    
+    def columns(self, now):
+        """(low, high) per bucket, oldest first, ending with the bucket of now"""
+        last = int(now // self.width)
+        columns = []
+        for bucket in range(last - self.buckets + 1, last + 1):
+            if self.newest is None or bucket > self.newest or bucket <= self.newest - self.buckets:
+                columns.append((math.nan, math.nan))
+            else:
+                i = bucket % self.buckets
+                columns.append((self.low[i], self.high[i]))
+        return columns
+
+class PowerGraph:
+    """Min/max series of power for the menu graphs, updated once per sample"""
+    
+    # Span in seconds and its title; each is drawn from BUCKETS columns
+    SPANS = ((60, "1 min"), (600, "10 min"), (3600, "60 min"))
+    BUCKETS = 60
+    
     def __init__(self):
-        self.config = self.load_config()
-        self.battery_path = f"/sys/class/power_supply/{self.config['battery_device']}"
-        self.last_notification = 0
+        self.series = {span: MinMaxSeries(span, self.BUCKETS) for span, title in self.SPANS}
+        self.version = 0
+    
+    def append(self, timestamp, watts):
+        for series in self.series.values():
+            series.append(timestamp, watts)
+        self.version += 1
+    
+    def fill(self, history):
+        """Add the samples of the longest span already in history"""
+        longest = self.SPANS[-1][0]
+        timestamps = history.column('timestamps', longest)
+        for timestamp, power in zip(timestamps, history.column('power', longest)):
+            self.append(timestamp, power / 1_000_000)
+
+# Colours of the power levels of color_coding, as RGBA
+GRAPH_COLORS = ((0x4c, 0xaf, 0x50, 0xff), (0xfb, 0xc0, 0x2d, 0xff),
+                (0xfb, 0x8c, 0x00, 0xff), (0xe5, 0x39, 0x35, 0xff))
+
+def render_sparkline(columns, width, height, thresholds):
+    """RGBA pixels of a min/max column chart of columns (low, high) in watts.
+    
+    Each column spans width // len(columns) pixels and is filled from its
+    low to its high value, so short spikes survive the downsampling. The
+    scale runs from 0 W to the highest value shown, and columns take the
+    colour of the power level of their high value.
+    """
+    pixels = bytearray(width * height * 4)
+    highs = [high for low, high in columns if not math.isnan(high)]
+    if not highs:
+        return pixels
+    
+    top = max(max(highs), 1.0)
+    column_width = max(width // len(columns), 1)
+    scale = (height - 1) / top
+    levels = (thresholds['low'], thresholds['medium'], thresholds['high'])
+    for index, (low, high) in enumerate(columns):
+        if math.isnan(high):
+            continue
+        color = bytes(GRAPH_COLORS[bisect_right(levels, high)])
+        top_row = height - 1 - round(high * scale)
+        bottom_row = height - 1 - round(max(low, 0) * scale)
+        left = index * column_width
+        for row in range(top_row, bottom_row + 1):
+            start = (row * width + left) * 4
+            pixels[start:start + column_width * 4] = color * column_width
+    return pixels
+
+LOG_DIR = Path.home() / ".local" / "share" / "battery-power-monitor"
+
+# Log record: epoch seconds, milliseconds, status code, pad, µV, µA
+LOG_RECORD = struct.Struct("<IHBxIi")
+LOG_MAGIC = b"BPMLOG01"
+
+class PowerLogWriter:
+    """Appends readings to segmented fixed-width binary log files.
+    
+    Records are packed into a buffer and written in one batch every
+    flush_interval seconds; fsync runs on its own, slower schedule. A
+    segment starts with a header the size of one record so record n is
+    always at offset (n + 1) * LOG_RECORD.size.
+    """
+    
+    def __init__(self, directory, flush_interval=60, fsync_interval=600,
+                 segment_bytes=4 << 20, segment_seconds=86400, keep_seconds=365 * 86400):
+        self.directory = Path(directory)
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.keep_seconds = keep_seconds
+        self.buffer = bytearray()
+        self.fd = None
+        self.segment_start = 0
+        self.segment_size = 0
+        self.last_flush = time.monotonic()
+        self.last_fsync = self.last_flush
+    
+    def append(self, snapshot):
+        """Queue a snapshot; readings without voltage or current are skipped"""
+        if snapshot.voltage is None or snapshot.current is None:
+            return
         
-        # Set up indicator
-        icon = self.get_icon_name()
-        self.indicator = AppIndicator3.Indicator.new(
-            "battery-power-monitor",
-            icon,
-            AppIndicator3.IndicatorCategory.HARDWARE
+        timestamp = snapshot.timestamp
+        seconds = int(timestamp)
+        self.buffer += LOG_RECORD.pack(
+            seconds,
+            int((timestamp - seconds) * 1000),
+            STATUS_CODES.get(snapshot.status, 0),
+            max(snapshot.voltage, 0),
+            snapshot.current
         )
-        self.indicator.set_status(AppIndicator3.IndicatorStatus.ACTIVE)
         
-        # Create menu
-        self.create_menu()
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+    
+    def open_segment(self, start):
+        """Start a new segment file and prune expired ones"""
+        self.close_segment()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        
+        path = self.directory / f"power-{start}.bin"
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND | os.O_CLOEXEC, 0o644)
+        self.segment_start = start
+        self.segment_size = os.fstat(self.fd).st_size
+        if self.segment_size == 0:
+            os.write(self.fd, LOG_MAGIC.ljust(LOG_RECORD.size, b"\0"))
+            self.segment_size = LOG_RECORD.size
+        
+        for old in log_segments(self.directory):
+            if old[0] < start - self.keep_seconds:
+                try:
+                    old[1].unlink()
+                except OSError:
+                    pass
+    
+    def close_segment(self):
+        if self.fd is not None:
+            os.fsync(self.fd)
+            os.close(self.fd)
+            self.fd = None
+    
+    def flush(self, sync=False):
+        """Write queued records, rotating and fsyncing when due"""
+        now = time.time()
+        self.last_flush = time.monotonic()
+        if not self.buffer:
+            return
+        
+        try:
+            if (self.fd is None or self.segment_size >= self.segment_bytes
+                    or now - self.segment_start >= self.segment_seconds):
+                # Segments are named after their first record
+                self.open_segment(LOG_RECORD.unpack_from(self.buffer)[0])
+            
+            os.write(self.fd, self.buffer)
+            self.segment_size += len(self.buffer)
+            
+            if sync or self.last_flush - self.last_fsync >= self.fsync_interval:
+                os.fsync(self.fd)
+                self.last_fsync = self.last_flush
+        except OSError as e:
+            print(f"Error writing power log: {e}")
+        self.buffer.clear()
+    
+    def close(self):
+        self.flush(sync=True)
+        self.close_segment()
+
+def log_segments(directory):
+    """Return (start time, path) of each log segment, oldest first"""
+    segments = []
+    for path in Path(directory).glob("power-*.bin"):
+        try:
+            segments.append((int(path.stem.split("-", 1)[1]), path))
+        except ValueError:
+            pass
+    segments.sort()
+    return segments
+
+class PowerLogReader:
+    """Reads time ranges from log segments through memory maps.
+    
+    Records in a segment are in time order, so the first record of a range
+    is found by binary search without reading the rest of the file.
+    """
+    
+    def __init__(self, directory=LOG_DIR):
+        self.directory = Path(directory)
+    
+    def read(self, start=0, end=None):
+        """Yield (timestamp, µV, µA, status) for records in [start, end)"""
+        if end is None:
+            end = float("inf")
+        
+        segments = log_segments(self.directory)
+        for n, (segment_start, path) in enumerate(segments):
+            if segment_start >= end:
+                break
+            if n + 1 < len(segments) and segments[n + 1][0] <= start:
+                continue
+            yield from self.read_segment(path, start, end)
+    
+    def read_segment(self, path, start, end):
+        size = LOG_RECORD.size
+        with open(path, 'rb') as f:
+            length = os.fstat(f.fileno()).st_size
+            if length <= size:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if data[:len(LOG_MAGIC)] != LOG_MAGIC:
+                    return
+                count = length // size - 1
+                
+                def timestamp_at(n):
+                    seconds, millis = LOG_RECORD.unpack_from(data, (n + 1) * size)[:2]
+                    return seconds + millis / 1000
+                
+                lo, hi = 0, count
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    if timestamp_at(mid) < start:
+                        lo = mid + 1
+                    else:
+                        hi = mid
+                
+                for n in range(lo, count):
+                    seconds, millis, status, voltage, current = LOG_RECORD.unpack_from(data, (n + 1) * size)
+                    timestamp = seconds + millis / 1000
+                    if timestamp >= end:
+                        break
+                    yield timestamp, voltage, current, STATUS_NAMES.get(status, "Unknown")
+
+def format_duration(seconds, compact=False):
+    """Format seconds as "3 h 05 min", or "3:05" when compact"""
+    minutes = int(seconds // 60)
+    hours, minutes = divmod(minutes, 60)
+    if compact:
+        return f"{hours}:{minutes:02d}"
+    if hours:
+        return f"{hours} h {minutes:02d} min"
+    return f"{minutes} min"
+
+class TimeEstimator:
+    """Time to empty or to full from remaining energy and smoothed power.
+    
+    Uses the 1 minute moving average of power; the confidence band spans
+    the estimates from the 10 second and 5 minute averages, so it widens
+    when the load is changing. The result is cached and only recomputed
+    when energy or power move by more than the tolerance or the status
+    changes, which keeps the per-tick cost O(1).
+    """
+    
+    def __init__(self, stats, tolerance=0.02):
+        self.stats = stats
+        self.tolerance = tolerance
+        self.inputs = None
+        self.estimate = None
+    
+    def changed(self, old, new):
+        return abs(new - old) > self.tolerance * max(abs(old), 1)
+    
+    def update(self, snapshot):
+        """Return (mode, seconds, low, high) or None.
+        
+        mode is "empty" or "full"; low and high bound seconds.
+        """
+        ema = self.stats.ema
+        power = ema[60]
+        status = snapshot.status
+        energy = snapshot.energy
+        if (power is None or energy is None or snapshot.energy_full is None
+                or status not in ("Charging", "Discharging")):
+            self.inputs = None
+            self.estimate = None
+            return None
+        
+        if self.inputs is not None:
+            old_energy, old_power, old_status = self.inputs
+            if (status == old_status and not self.changed(old_energy, energy)
+                    and not self.changed(old_power, power)):
+                return self.estimate
+        self.inputs = (energy, power, status)
+        
+        if status == "Discharging":
+            mode, remaining = "empty", energy
+        else:
+            mode, remaining = "full", max(snapshot.energy_full - energy, 0)
+        
+        # µWh / W = seconds / 3600 * 1e-6
+        def seconds_at(watts):
+            watts = abs(watts)
+            if watts < 0.01:
+                return None
+            return remaining / 1_000_000 / watts * 3600
+        
+        seconds = seconds_at(power)
+        if seconds is None:
+            self.estimate = None
+            return None
+        
+        bounds = [value for value in (seconds_at(ema[10]), seconds, seconds_at(ema[300]))
+                  if value is not None]
+        self.estimate = (mode, seconds, min(bounds), max(bounds))
+        return self.estimate
+
+ENERGY_FILE = LOG_DIR / "energy.json"
+
+class EnergyAccount:
+    """Watt-hours per session, calendar day and discharge cycle.
+    
+    Each reading adds the trapezoid between it and the previous reading,
+    so irregular intervals (adaptive polling, uevent refreshes) integrate
+    correctly and a tick costs a few additions. Gaps longer than MAX_GAP
+    (suspend, a long pause) are not integrated. Energy goes to charged_wh
+    while the battery was charging and to discharged_wh otherwise.
+    
+    A discharge cycle starts when the status changes to Discharging and
+    ends at the next status change. Finished days and cycles are kept
+    (the latest KEEP_DAYS and KEEP_CYCLES), and everything but the session
+    is checkpointed to a small JSON file every checkpoint_interval seconds
+    and on close.
+    """
+    
+    MAX_GAP = 300
+    KEEP_DAYS = 31
+    KEEP_CYCLES = 50
+    
+    def __init__(self, checkpoint_interval=300, path=None):
+        self.path = Path(path if path is not None else ENERGY_FILE)
+        self.checkpoint_interval = checkpoint_interval
+        self.session = self.new_total(time.time())
+        self.day = None
+        self.day_ends = None
+        self.cycle = None
+        self.days = deque(maxlen=self.KEEP_DAYS)
+        self.cycles = deque(maxlen=self.KEEP_CYCLES)
+        self.last = None   # (timestamp, watts, status) of the previous reading
+        self.last_checkpoint = time.monotonic()
+        self.load()
+    
+    def new_total(self, timestamp, **extra):
+        return {"start": timestamp, "end": timestamp, "discharged_wh": 0.0, "charged_wh": 0.0, **extra}
+    
+    def start_day(self, timestamp):
+        """Close the current day and open the one holding timestamp"""
+        if self.day is not None:
+            self.days.append(self.day)
+        local = time.localtime(timestamp)
+        self.day = self.new_total(timestamp, date=time.strftime("%Y-%m-%d", local))
+        # mktime normalises the day after the last of the month
+        self.day_ends = time.mktime((local.tm_year, local.tm_mon, local.tm_mday + 1, 0, 0, 0, 0, 0, -1))
+    
+    def start_cycle(self, snapshot):
+        self.cycle = self.new_total(snapshot.timestamp, start_capacity=snapshot.capacity,
+                                    end_capacity=snapshot.capacity)
+    
+    def end_cycle(self):
+        self.cycles.append(self.cycle)
+        self.cycle = None
+    
+    def add(self, snapshot):
+        """Integrate up to this reading and handle day and status changes"""
+        timestamp = snapshot.timestamp
+        watts = snapshot.watts
+        status = snapshot.status
+        if self.day_ends is None or timestamp >= self.day_ends:
+            self.start_day(timestamp)
+        
+        previous = self.last
+        if status is None and previous is not None:
+            # A failed status read is not a status change
+            status = previous[2]
+        self.last = (timestamp, watts, status)
+        if previous is None:
+            # A cycle restored from the checkpoint only goes on if the
+            # battery is still discharging and was not charged in between
+            cycle = self.cycle
+            if cycle is not None and (status != "Discharging" or snapshot.capacity is None
+                                      or cycle["end_capacity"] is None
+                                      or snapshot.capacity > cycle["end_capacity"]):
+                self.end_cycle()
+            if self.cycle is None and status == "Discharging":
+                self.start_cycle(snapshot)
+            return
+        
+        last_timestamp, last_watts, last_status = previous
+        elapsed = timestamp - last_timestamp
+        if watts is not None and last_watts is not None and 0 < elapsed <= self.MAX_GAP:
+            energy = (last_watts + watts) * elapsed / 7200
+            key = "charged_wh" if last_status == "Charging" else "discharged_wh"
+            self.session[key] += energy
+            self.day[key] += energy
+            if self.cycle is not None:
+                self.cycle[key] += energy
+        self.session["end"] = timestamp
+        self.day["end"] = timestamp
+        
+        if self.cycle is not None:
+            self.cycle["end"] = timestamp
+            self.cycle["end_capacity"] = snapshot.capacity
+        if status != last_status:
+            if self.cycle is not None:
+                self.end_cycle()
+            if status == "Discharging":
+                self.start_cycle(snapshot)
+        
+        if time.monotonic() - self.last_checkpoint >= self.checkpoint_interval:
+            self.checkpoint()
+    
+    def report(self, history=False):
+        """Current totals, plus the finished days and cycles with history"""
+        data = {"session": self.session, "day": self.day, "cycle": self.cycle}
+        if history:
+            data["days"] = list(self.days)
+            data["cycles"] = list(self.cycles)
+        return data
+    
+    def load(self):
+        """Restore the day, the open cycle and the history from the checkpoint"""
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Error loading energy totals: {e}")
+            return
+        
+        self.days.extend(data.get("days", ()))
+        self.cycles.extend(data.get("cycles", ()))
+        self.cycle = data.get("cycle")
+        day = data.get("day")
+        if day is not None:
+            self.start_day(time.time())
+            if day.get("date") == self.day["date"]:
+                self.day = day
+            else:
+                self.days.append(day)
+    
+    def checkpoint(self):
+        """Write the totals to a temporary file and rename it over the old one"""
+        self.last_checkpoint = time.monotonic()
+        data = self.report(history=True)
+        del data["session"]
+        temporary = self.path.with_suffix(".tmp")
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(temporary, "w") as f:
+                json.dump(data, f)
+            os.replace(temporary, self.path)
+        except OSError as e:
+            print(f"Error saving energy totals: {e}")
+
+class BatterySampler:
+    """Reads battery attributes through persistent sysfs file descriptors.
+    
+    Each attribute is opened once and re-read with a positioned read at
+    offset 0 into a preallocated buffer, so a sample costs one syscall per
+    attribute instead of open/read/close. A failed read (the device was
+    hot-unplugged) closes the descriptor and reopens it transparently.
+    
+    The first sample probes which attributes the device has and caches the
+    cheapest accurate source of power (see SOURCES), so the per-tick path
+    never tries and fails. Devices without an instantaneous reading get
+    power from the change of energy_now or charge_now over time.
+    """
+    
+    # Power sources, cheapest first
+    SOURCES = ("power_now", "voltage_current", "energy_delta", "charge_delta")
+    BUFFER_SIZE = 64
+    
+    # Seconds before retrying an attribute that could not be opened
+    RETRY_INTERVAL = 10
+    
+    def __init__(self, device_path):
+        self.device_path = device_path
+        self.fds = {}
+        self.missing = {}
+        self.buffer = bytearray(self.BUFFER_SIZE)
+        self.buffers = [self.buffer]
+        self.reads = 0
+        
+        # Also read voltage and current when power comes from power_now
+        self.read_details = True
+        
+        # Also read remaining and full energy (for time estimates)
+        self.read_energy = False
+        self.energy_full = None
+        self.energy_full_at = None
+        
+        self.source = None
+        self.probed_at = None
+        self.last_counter = None
+        self.last_counter_time = None
+        self.counter_changed = False
+        self.counter_power = None
+        self.counter_interval = None
+        self.counter_status = None
+    
+    def open_attribute(self, name):
+        """Open an attribute file, remembering failures for RETRY_INTERVAL"""
+        failed_at = self.missing.get(name)
+        if failed_at is not None and time.monotonic() - failed_at < self.RETRY_INTERVAL:
+            return None
+        
+        try:
+            fd = os.open(os.path.join(self.device_path, name), os.O_RDONLY | os.O_CLOEXEC)
+        except OSError:
+            self.missing[name] = time.monotonic()
+            return None
+        
+        self.missing.pop(name, None)
+        self.fds[name] = fd
+        return fd
+    
+    def close_attribute(self, name):
+        """Close the descriptor of an attribute if it is open"""
+        fd = self.fds.pop(name, None)
+        if fd is not None:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+    
+    def read_raw(self, name):
+        """Read an attribute into the shared buffer, returning the byte count"""
+        fd = self.fds.get(name)
+        if fd is None:
+            fd = self.open_attribute(name)
+            if fd is None:
+                return None
+        
+        self.reads += 1
+        try:
+            length = os.preadv(fd, self.buffers, 0)
+            # sysfs attributes always end in a newline; an empty read means
+            # the file went away (as in fake-battery.py's hotplug)
+            if length:
+                return length
+        except OSError:
+            pass
+        
+        # Stale descriptor (device removed and re-added): reopen once
+        self.close_attribute(name)
+        self.missing.pop(name, None)
+        fd = self.open_attribute(name)
+        if fd is None:
+            return None
+        
+        try:
+            return os.preadv(fd, self.buffers, 0)
+        except OSError:
+            self.close_attribute(name)
+            self.missing[name] = time.monotonic()
+            return None
+    
+    def read_value(self, name):
+        """Read an integer attribute, or None if unavailable"""
+        length = self.read_raw(name)
+        if not length:
+            return None
+        
+        try:
+            return int(self.buffer[:length])
+        except ValueError:
+            return None
+    
+    def read_string(self, name):
+        """Read a string attribute, or None if unavailable"""
+        length = self.read_raw(name)
+        if not length:
+            return None
+        return self.buffer[:length].decode('ascii', 'replace').strip()
+    
+    def probe(self):
+        """Choose and cache the power source for this device"""
+        def has(name):
+            return self.read_value(name) is not None
+        
+        self.missing.clear()
+        if has("power_now"):
+            self.source = "power_now"
+        elif has("voltage_now") and has("current_now"):
+            self.source = "voltage_current"
+        elif has("energy_now"):
+            self.source = "energy_delta"
+        elif has("charge_now") and has("voltage_now"):
+            self.source = "charge_delta"
+        else:
+            self.source = None
+        
+        self.probed_at = time.monotonic()
+        self.reset_counter()
+        return self.source
+    
+    def power_from_counter(self, timestamp, counter, voltage=None):
+        """Derive µW from an energy (µWh) or charge (µAh at voltage µV) counter.
+        
+        Counters only move every few seconds, so the rate is taken between
+        successive changes and held in between. The first change after
+        startup only sets the baseline. A held rate expires once the
+        counter has not moved for twice its last update interval (it
+        stops on AC or when full).
+        """
+        if counter is None:
+            return self.counter_power
+        
+        if self.last_counter is None:
+            self.last_counter = counter
+            self.last_counter_time = timestamp
+            return None
+        
+        if counter != self.last_counter:
+            if self.counter_changed:
+                dt = timestamp - self.last_counter_time
+                if dt > 0:
+                    rate = abs(counter - self.last_counter) * 3600 / dt
+                    if voltage is not None:
+                        rate = rate * voltage / 1_000_000
+                    self.counter_power = int(rate)
+                    self.counter_interval = dt
+            self.counter_changed = True
+            self.last_counter = counter
+            self.last_counter_time = timestamp
+        elif (self.counter_power is not None
+                and timestamp - self.last_counter_time > 2 * self.counter_interval):
+            self.counter_power = None
+        return self.counter_power
+    
+    def reset_counter(self):
+        """Forget the counter rate and baseline (after a status change)"""
+        self.last_counter = None
+        self.counter_changed = False
+        self.counter_power = None
+    
+    def sample(self):
+        """Read all attributes at once into a PowerSnapshot.
+        
+        Any field the device does not provide is None.
+        """
+        timestamp = time.time()
+        if self.probed_at is None or (self.source is None
+                                      and time.monotonic() - self.probed_at >= self.RETRY_INTERVAL):
+            self.probe()
+        
+        source = self.source
+        voltage = current = power = counter = None
+        if source == "voltage_current":
+            voltage = self.read_value("voltage_now")
+            current = self.read_value("current_now")
+            if voltage is not None and current is not None:
+                power = voltage * current // 1_000_000
+        elif source == "power_now":
+            power = self.read_value("power_now")
+            if self.read_details:
+                voltage = self.read_value("voltage_now")
+                current = self.read_value("current_now")
+                if current is None and power is not None and voltage:
+                    current = power * 1_000_000 // voltage
+        elif source == "energy_delta":
+            if self.read_details:
+                voltage = self.read_value("voltage_now")
+            counter = self.read_value("energy_now")
+            power = self.power_from_counter(timestamp, counter)
+            if power is not None and voltage:
+                current = power * 1_000_000 // voltage
+        elif source == "charge_delta":
+            voltage = self.read_value("voltage_now")
+            counter = self.read_value("charge_now")
+            power = self.power_from_counter(timestamp, counter, voltage)
+            if power is not None and voltage:
+                current = power * 1_000_000 // voltage
+        
+        status = self.read_string("status")
+        capacity = self.read_value("capacity")
+        
+        # A rate from before charging started or stopped no longer applies;
+        # the baseline restarts from the next counter change
+        if counter is not None and status is not None and status != self.counter_status:
+            if self.counter_status is not None:
+                self.reset_counter()
+                power = current = None
+            self.counter_status = status
+        
+        energy = energy_full = None
+        if self.read_energy:
+            energy, energy_full = self.read_energy_values(counter, voltage)
+        
+        return PowerSnapshot(timestamp, voltage, current, power, status, capacity,
+                             energy=energy, energy_full=energy_full)
+    
+    @property
+    def counts_energy(self):
+        """Whether power comes from an energy or charge counter"""
+        return self.source in ("energy_delta", "charge_delta")
+    
+    def read_power(self):
+        """Power in µW from power_now or voltage × current only, or None.
+        
+        For burst captures: one or two reads and no snapshot. Energy and
+        charge counters move far too rarely to be read at a high rate.
+        """
+        if self.source == "power_now":
+            return self.read_value("power_now")
+        if self.source == "voltage_current":
+            voltage = self.read_value("voltage_now")
+            current = self.read_value("current_now")
+            if voltage is not None and current is not None:
+                return voltage * current // 1_000_000
+        return None
+    
+    def read_energy_values(self, counter, voltage):
+        """Return remaining and full energy in µWh, or None for either.
+        
+        counter is the energy_now/charge_now value already read this sample,
+        if any. Full energy changes slowly and is re-read once a minute.
+        Charge-only batteries are converted at the present voltage.
+        """
+        charge = "charge" in (self.source or "")
+        if counter is None:
+            counter = self.read_value("charge_now" if charge else "energy_now")
+            if counter is None and not charge:
+                charge = True
+                counter = self.read_value("charge_now")
+        if counter is None:
+            return None, None
+        
+        now = time.monotonic()
+        if self.energy_full_at is None or now - self.energy_full_at >= 60:
+            self.energy_full = self.read_value("charge_full" if charge else "energy_full")
+            self.energy_full_at = now
+        
+        if not charge:
+            return counter, self.energy_full
+        
+        if voltage is None:
+            voltage = self.read_value("voltage_now")
+        if not voltage:
+            return None, None
+        full = self.energy_full * voltage // 1_000_000 if self.energy_full is not None else None
+        return counter * voltage // 1_000_000, full
+    
+    def close(self):
+        """Close all open descriptors"""
+        for name in list(self.fds):
+            self.close_attribute(name)
+
+def discover_power_supplies(root=None):
+    """Classify every power supply by its type attribute.
+    
+    Returns {name: type}, e.g. {"AC": "Mains", "BAT0": "Battery"}.
+    Batteries of peripherals (scope "Device", e.g. a wireless mouse) are
+    reported as "Device" so they are not counted as system batteries.
+    """
+    if root is None:
+        root = POWER_SUPPLY_ROOT
+    supplies = {}
+    try:
+        names = sorted(os.listdir(root))
+    except OSError:
+        return supplies
+    
+    for name in names:
+        path = os.path.join(root, name)
+        try:
+            with open(os.path.join(path, "type")) as f:
+                kind = f.read().strip()
+        except OSError:
+            kind = "Unknown"
+        
+        try:
+            with open(os.path.join(path, "scope")) as f:
+                if f.read().strip() == "Device":
+                    kind = "Device"
+        except OSError:
+            pass
+        supplies[name] = kind
+    return supplies
+
+def combine_status(statuses):
+    """Overall status of several batteries"""
+    if "Charging" in statuses:
+        return "Charging"
+    if "Discharging" in statuses:
+        return "Discharging"
+    if statuses and all(status == "Full" for status in statuses):
+        return "Full"
+    return statuses[0] if statuses else None
+
+class SupplyGroupSampler:
+    """Samples all system batteries in one pass and reports the total.
+    
+    Built from a discover_power_supplies() result, so the directory is not
+    rescanned on every tick; the monitor builds a new one on hotplug.
+    Capacity is weighted by each battery's full energy, charge-only packs
+    converted with their voltage; if any pack lacks it, all weigh the same.
+    """
+    
+    def __init__(self, root, supplies):
+        self.batteries = {}
+        self.adapters = {}
+        for name, kind in supplies.items():
+            if kind == "Battery":
+                self.batteries[name] = BatterySampler(os.path.join(root, name))
+            elif kind in ("Mains", "USB"):
+                self.adapters[name] = BatterySampler(os.path.join(root, name))
+        
+        self.weights = {name: self.full_energy(sampler)
+                        for name, sampler in self.batteries.items()}
+        # Without the full energy of every pack the weights would not be
+        # comparable, so all packs count the same
+        if not all(self.weights.values()):
+            self.weights = dict.fromkeys(self.weights, 1)
+    
+    @staticmethod
+    def full_energy(sampler):
+        """Full energy of a battery in µWh, or None if it cannot be known.
+        
+        Charge-only batteries are converted at their design voltage, or the
+        present one if the driver does not report it.
+        """
+        full = sampler.read_value("energy_full")
+        if full:
+            return full
+        
+        full = sampler.read_value("charge_full")
+        voltage = sampler.read_value("voltage_min_design") or sampler.read_value("voltage_now")
+        if not full or not voltage:
+            return None
+        return full * voltage // 1_000_000
+    
+    def sample(self):
+        """Sample every battery and return the combined PowerSnapshot"""
+        packs = tuple((name, sampler.sample()) for name, sampler in self.batteries.items())
+        
+        powers = [pack.power for name, pack in packs if pack.power is not None]
+        voltages = [pack.voltage for name, pack in packs if pack.voltage is not None]
+        currents = [pack.current for name, pack in packs if pack.current is not None]
+        statuses = [pack.status for name, pack in packs if pack.status is not None]
+        
+        capacity = None
+        weighted = [(pack.capacity, self.weights[name]) for name, pack in packs
+                    if pack.capacity is not None]
+        if weighted:
+            total_weight = sum(weight for value, weight in weighted)
+            capacity = round(sum(value * weight for value, weight in weighted) / total_weight)
+        
+        ac_online = None
+        if self.adapters:
+            ac_online = any(sampler.read_value("online") for sampler in self.adapters.values())
+        
+        energy = energy_full = None
+        if packs and all(pack.energy is not None and pack.energy_full is not None
+                         for name, pack in packs):
+            energy = sum(pack.energy for name, pack in packs)
+            energy_full = sum(pack.energy_full for name, pack in packs)
+        
+        return PowerSnapshot(
+            packs[0][1].timestamp if packs else time.time(),
+            sum(voltages) // len(voltages) if voltages else None,
+            sum(currents) if currents else None,
+            sum(powers) if powers else None,
+            combine_status(statuses),
+            capacity,
+            packs,
+            ac_online,
+            energy,
+            energy_full
+        )
+    
+    def read_power(self):
+        """Total power in µW of the batteries that have an instantaneous reading"""
+        total = None
+        for sampler in self.batteries.values():
+            power = sampler.read_power()
+            if power is not None:
+                total = power if total is None else total + power
+        return total
+    
+    @property
+    def counts_energy(self):
+        """Whether any battery's power comes from an energy or charge counter"""
+        return any(sampler.counts_energy for sampler in self.batteries.values())
+    
+    @property
+    def reads(self):
+        """sysfs reads made by all the samplers"""
+        return sum(sampler.reads for sampler in (*self.batteries.values(), *self.adapters.values()))
+    
+    def close(self):
+        for sampler in (*self.batteries.values(), *self.adapters.values()):
+            sampler.close()
+
+def open_sampler(device, supplies):
+    """Sampler for the named battery, or for all batteries when device is auto"""
+    if device != "auto":
+        if device in supplies:
+            return BatterySampler(os.path.join(POWER_SUPPLY_ROOT, device))
+        print(f"Battery device {device} not found, using all batteries")
+    return SupplyGroupSampler(POWER_SUPPLY_ROOT, supplies)
+
+RUNTIME_DIR = Path(os.environ.get("XDG_RUNTIME_DIR") or f"/tmp/battery-power-monitor-{os.getuid()}")
+CONTROL_SOCKET = RUNTIME_DIR / "battery-power-monitor.sock"
+LOCK_FILE = RUNTIME_DIR / "battery-power-monitor.lock"
+
+def check_runtime_dir():
+    """Create RUNTIME_DIR if needed and make sure no other user controls it.
+    
+    The /tmp fallback could be created first by someone else, who could
+    then hold the lock or answer our commands. Raises PermissionError
+    unless it is a directory (not a symlink) owned by us with mode 0700.
+    """
+    try:
+        os.mkdir(RUNTIME_DIR, 0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(RUNTIME_DIR)
+    if (not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid()
+            or stat.S_IMODE(info.st_mode) != 0o700):
+        raise PermissionError(f"{RUNTIME_DIR} must be a directory owned by you with mode 0700")
+
+def acquire_instance_lock():
+    """Lock the instance lock file, or return None if another monitor holds it.
+    
+    The returned descriptor must stay open for the life of the process.
+    Raises OSError if the runtime directory is not safe to use.
+    """
+    check_runtime_dir()
+    fd = os.open(LOCK_FILE, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC | os.O_NOFOLLOW, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+def send_command(command, timeout=2.0):
+    """Send a command to the running monitor.
+    
+    Returns the decoded reply, or None if no monitor is listening.
+    """
+    try:
+        check_runtime_dir()
+    except OSError as e:
+        print(f"Error: {e}")
+        return None
+    
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        try:
+            sock.connect(str(CONTROL_SOCKET))
+            sock.sendall(command.encode() + b"\n")
+            data = b""
+            while not data.endswith(b"\n"):
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+        except OSError:
+            return None
+    return json.loads(data) if data else None
+
+class ControlServer:
+    """Line-based command socket served from the GLib main loop.
+    
+    A client sends one line ("command [argument]") and gets one line of
+    JSON back. Connections are read and written without blocking, so a
+    slow or stuck client never stalls the monitor.
+    """
+    
+    MAX_LINE = 4096
+    
+    def __init__(self, path, handler):
+        self.path = path
+        self.handler = handler
+        self.clients = {}
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        
+        self.sock = socket.socket(socket.AF_UNIX,
+                                  socket.SOCK_STREAM | socket.SOCK_NONBLOCK | socket.SOCK_CLOEXEC)
+        self.sock.bind(str(path))
+        os.chmod(path, 0o600)
+        self.sock.listen(4)
+        self.watch = GLib.io_add_watch(self.sock.fileno(), GLib.PRIORITY_DEFAULT,
+                                       GLib.IO_IN, self.on_accept)
+    
+    def on_accept(self, fd, condition):
+        try:
+            conn, address = self.sock.accept()
+        except OSError:
+            return True
+        
+        conn.setblocking(False)
+        self.clients[conn.fileno()] = (conn, bytearray())
+        GLib.io_add_watch(conn.fileno(), GLib.PRIORITY_DEFAULT,
+                          GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR, self.on_client)
+        return True
+    
+    def on_client(self, fd, condition):
+        conn, buffer = self.clients[fd]
+        try:
+            data = conn.recv(self.MAX_LINE)
+        except BlockingIOError:
+            return True
+        except OSError:
+            data = b""
+        
+        buffer += data
+        if data and b"\n" not in buffer and len(buffer) < self.MAX_LINE:
+            return True
+        
+        line = bytes(buffer).split(b"\n", 1)[0].decode('utf-8', 'replace').strip()
+        if not line:
+            conn.close()
+            del self.clients[fd]
+            return False
+        
+        command, sep, argument = line.partition(" ")
+        try:
+            reply = self.handler(command, argument)
+        except Exception as e:
+            reply = {"ok": False, "error": str(e)}
+        
+        # The buffer now holds the reply, sent whenever the client can take it
+        self.clients[fd] = (conn, bytearray(json.dumps(reply).encode() + b"\n"))
+        GLib.io_add_watch(fd, GLib.PRIORITY_DEFAULT,
+                          GLib.IO_OUT | GLib.IO_HUP | GLib.IO_ERR, self.on_writable)
+        return False
+    
+    def on_writable(self, fd, condition):
+        conn, output = self.clients[fd]
+        if not condition & (GLib.IO_HUP | GLib.IO_ERR):
+            try:
+                sent = conn.send(output)
+            except BlockingIOError:
+                return True
+            except OSError:
+                sent = len(output)
+            del output[:sent]
+            if output:
+                return True
+        
+        conn.close()
+        del self.clients[fd]
+        return False
+    
+    def close(self):
+        GLib.source_remove(self.watch)
+        for conn, buffer in self.clients.values():
+            conn.close()
+        self.sock.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+class MetricsServer:
+    """Minimal HTTP server for scrapers, served from a selectors loop.
+    
+    Each connection gets one response and is closed. render(path) returns
+    (content type, body), or None for a 404.
+    """
+    
+    MAX_REQUEST = 8192
+    
+    def __init__(self, address, port, selector, render):
+        self.selector = selector
+        self.render = render
+        self.clients = {}
+        self.sock = socket.socket(socket.AF_INET6 if ":" in address else socket.AF_INET,
+                                  socket.SOCK_STREAM | socket.SOCK_NONBLOCK | socket.SOCK_CLOEXEC)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((address, port))
+        self.sock.listen(16)
+        self.selector.register(self.sock, selectors.EVENT_READ, self.on_accept)
+    
+    def on_accept(self, sock):
+        try:
+            conn, address = sock.accept()
+        except OSError:
+            return
+        
+        conn.setblocking(False)
+        self.clients[conn] = bytearray()
+        self.selector.register(conn, selectors.EVENT_READ, self.on_client)
+    
+    def on_client(self, conn):
+        buffer = self.clients[conn]
+        try:
+            data = conn.recv(self.MAX_REQUEST)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        
+        buffer += data
+        if data and b"\r\n\r\n" not in buffer and b"\n\n" not in buffer \
+                and len(buffer) < self.MAX_REQUEST:
+            return
+        
+        if not data:
+            self.drop(conn)
+            return
+        
+        # The buffer now holds the response, sent whenever the client can take it
+        self.clients[conn] = bytearray(self.respond(bytes(buffer).split(b"\n", 1)[0]))
+        self.selector.modify(conn, selectors.EVENT_WRITE, self.on_writable)
+    
+    def on_writable(self, conn):
+        output = self.clients[conn]
+        try:
+            sent = conn.send(output)
+        except BlockingIOError:
+            return
+        except OSError:
+            sent = len(output)
+        del output[:sent]
+        if not output:
+            self.drop(conn)
+    
+    def respond(self, request_line):
+        """Full HTTP response to a request line (e.g. GET /metrics HTTP/1.1)"""
+        fields = request_line.decode('latin-1').split()
+        if len(fields) < 2 or fields[0] not in ("GET", "HEAD"):
+            status, content_type, body = "405 Method Not Allowed", "text/plain", b"GET only\n"
+        else:
+            response = self.render(fields[1].split("?", 1)[0])
+            if response is None:
+                status, content_type, body = "404 Not Found", "text/plain", b"Try /metrics or /json\n"
+            else:
+                status = "200 OK"
+                content_type, body = response
+        
+        header = (f"HTTP/1.0 {status}\r\nContent-Type: {content_type}\r\n"
+                  f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n").encode()
+        if fields and fields[0] == "HEAD":
+            return header
+        return header + body
+    
+    def drop(self, conn):
+        self.selector.unregister(conn)
+        conn.close()
+        del self.clients[conn]
+    
+    def close(self):
+        for conn in list(self.clients):
+            self.drop(conn)
+        self.selector.unregister(self.sock)
+        self.sock.close()
+
+NETLINK_KOBJECT_UEVENT = 15
+
+def parse_uevent(data):
+    """Parse a kernel uevent datagram into (action, properties).
+    
+    Kernel messages are "action@devpath" followed by NUL separated
+    KEY=VALUE pairs. Returns None for anything else (e.g. libudev messages).
+    """
+    fields = data.split(b"\0")
+    header = fields[0].decode('ascii', 'replace')
+    if "@" not in header:
+        return None
+    
+    properties = {}
+    for field in fields[1:]:
+        key, sep, value = field.partition(b"=")
+        if sep:
+            properties[key.decode('ascii', 'replace')] = value.decode('ascii', 'replace')
+    return header.split("@", 1)[0], properties
+
+class UeventSource:
+    """Receives power_supply uevents from the kernel netlink socket"""
+    
+    def __init__(self):
+        self.sock = socket.socket(
+            socket.AF_NETLINK,
+            socket.SOCK_RAW | socket.SOCK_NONBLOCK | socket.SOCK_CLOEXEC,
+            NETLINK_KOBJECT_UEVENT
+        )
+        # Multicast group 1 carries the kernel's own events
+        self.sock.bind((0, 1))
+    
+    def fileno(self):
+        return self.sock.fileno()
+    
+    def receive(self):
+        """Drain pending messages and return the power_supply events.
+        
+        Each event is (action, properties); a plug-in usually produces
+        several at once, so callers should refresh once per batch.
+        """
+        events = []
+        while True:
+            try:
+                data = self.sock.recv(8192)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                if e.errno != errno.ENOBUFS:
+                    raise
+                # Events were dropped, report a generic change
+                events.append(("change", {"SUBSYSTEM": "power_supply"}))
+                continue
+            
+            event = parse_uevent(data)
+            if event is not None and event[1].get("SUBSYSTEM") == "power_supply":
+                events.append(event)
+        return events
+    
+    def close(self):
+        self.sock.close()
+
+class FakeUeventSource(UeventSource):
+    """Uevent source fed from Python, for testing without hardware.
+    
+    Messages travel through a socket pair in the kernel wire format, so
+    the monitor handles them exactly like real netlink events.
+    """
+    
+    def __init__(self):
+        self.sock, self.writer = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+    
+    def emit(self, action="change", name="BAT0", **properties):
+        """Send a power_supply event for the named device"""
+        fields = [
+            f"{action}@/devices/virtual/power_supply/{name}",
+            f"ACTION={action}",
+            "SUBSYSTEM=power_supply",
+            f"POWER_SUPPLY_NAME={name}",
+        ]
+        fields += [f"POWER_SUPPLY_{key.upper()}={value}" for key, value in properties.items()]
+        self.writer.send("\0".join(fields).encode('ascii') + b"\0")
+    
+    def close(self):
+        self.writer.close()
+        self.sock.close()
+
+class Notifier:
+    """Sends desktop notifications without blocking the main loop.
+    
+    Notify is called asynchronously on org.freedesktop.Notifications over
+    the session bus, and the returned id is passed back on the next call so
+    a repeated alert replaces its bubble instead of stacking. Without a
+    session bus, notify-send runs on a background worker thread.
+    Notifications sent while the bus is still connecting wait for it.
+    """
+    
+    APP_NAME = "Battery Power Monitor"
+    
+    def __init__(self):
+        self.bus = None
+        self.connecting = True
+        self.waiting = []
+        self.replaces_id = 0
+        self.queue = None
+        Gio.bus_get(Gio.BusType.SESSION, None, self.on_bus)
+    
+    def on_bus(self, source, result):
+        try:
+            self.bus = Gio.bus_get_finish(result)
+        except Exception as e:
+            print(f"Session bus unavailable, using notify-send: {e}")
+        self.connecting = False
+        waiting, self.waiting = self.waiting, []
+        for notification in waiting:
+            self.send(*notification)
+    
+    def send(self, summary, body, icon="battery-caution", timeout=5000):
+        """Show a notification; returns immediately"""
+        if self.connecting:
+            self.waiting.append((summary, body, icon, timeout))
+            return
+        if self.bus is None:
+            self.send_fallback(summary, body, timeout)
+            return
+        
+        hints = {"urgency": GLib.Variant("y", 1)}
+        self.bus.call(
+            "org.freedesktop.Notifications",
+            "/org/freedesktop/Notifications",
+            "org.freedesktop.Notifications",
+            "Notify",
+            GLib.Variant("(susssasa{sv}i)", (
+                self.APP_NAME, self.replaces_id, icon, summary, body, [], hints, timeout
+            )),
+            GLib.VariantType.new("(u)"),
+            Gio.DBusCallFlags.NONE,
+            -1,
+            None,
+            self.on_notified
+        )
+    
+    def on_notified(self, bus, result):
+        try:
+            self.replaces_id = bus.call_finish(result).unpack()[0]
+        except Exception as e:
+            print(f"Error sending notification: {e}")
+    
+    def send_fallback(self, summary, body, timeout):
+        """Queue a notify-send call for the worker thread"""
+        if self.queue is None:
+            self.queue = queue.Queue(maxsize=4)
+            threading.Thread(target=self.run_worker, name="notify-send", daemon=True).start()
+        
+        try:
+            self.queue.put_nowait((summary, body, timeout))
+        except queue.Full:
+            pass
+    
+    def run_worker(self):
+        import subprocess
+        while True:
+            summary, body, timeout = self.queue.get()
+            try:
+                subprocess.run(['notify-send', summary, body, '-u', 'normal', '-t', str(timeout)])
+            except OSError as e:
+                print(f"Error running notify-send: {e}")
+
+class AlertRule:
+    """A condition that has to hold continuously for a while to alert.
+    
+    evaluate() is called once per reading and only compares against the
+    time the condition started holding, so a rule costs O(1) per tick and
+    a single spike shorter than duration never fires it.
+    """
+    
+    METRICS = {"power": ("Power", "W"), "power_avg": ("1 min average power", "W"),
+               "capacity": ("Capacity", "%")}
+    
+    def __init__(self, name, metric, condition, value, duration=0, status=None, cooldown=300):
+        self.name = name
+        self.metric = metric
+        self.condition = condition
+        self.value = value
+        self.duration = duration
+        self.status = status
+        self.cooldown = cooldown
+        self.since = None
+        self.last_alert = None
+    
+    @classmethod
+    def config_problems(cls, rule, prefix):
+        """The problems with a rule from the config file (empty if valid)"""
+        problems = []
+        metric = rule.get('metric')
+        if not isinstance(metric, str) or metric not in cls.METRICS:
+            problems.append(f"{prefix}.metric should be one of {', '.join(cls.METRICS)}, not {metric!r}")
+        condition = rule.get('condition')
+        if condition not in (">", "<"):
+            problems.append(f"{prefix}.condition should be \">\" or \"<\", not {condition!r}")
+        value = rule.get('value')
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            problems.append(f"{prefix}.value should be a number, not {value!r}")
+        status = rule.get('status')
+        if status is not None and not isinstance(status, str):
+            problems.append(f"{prefix}.status should be null or a status name, not {status!r}")
+        for key in ("duration", "cooldown"):
+            value = rule.get(key, 0)
+            if not isinstance(value, (int, float)) or isinstance(value, bool) or value < 0:
+                problems.append(f"{prefix}.{key} should be a number of at least 0, not {value!r}")
+        return problems
+    
+    @classmethod
+    def from_config(cls, rule):
+        return cls(
+            rule.get('name', "Battery Alert"),
+            rule['metric'],
+            rule['condition'],
+            rule['value'],
+            rule.get('duration', 0),
+            rule.get('status'),
+            rule.get('cooldown', 300)
+        )
+    
+    def measure(self, snapshot, stats):
+        if self.metric == "power":
+            return snapshot.watts
+        if self.metric == "power_avg":
+            return stats.ema[60]
+        if self.metric == "capacity":
+            return snapshot.capacity
+        return None
+    
+    def evaluate(self, snapshot, stats):
+        """Return the measured value if the rule fires now, else None"""
+        value = self.measure(snapshot, stats)
+        holds = (value is not None
+                 and (self.status is None or snapshot.status == self.status)
+                 and (value > self.value if self.condition == ">" else value < self.value))
+        if not holds:
+            self.since = None
+            return None
+        
+        now = snapshot.timestamp
+        if self.since is None:
+            self.since = now
+        if now - self.since < self.duration:
+            return None
+        if self.last_alert is not None and now - self.last_alert < self.cooldown:
+            return None
+        
+        self.last_alert = now
+        return value
+    
+    def message(self, value):
+        """Notification summary and body for a firing at value"""
+        label, unit = self.METRICS.get(self.metric, (self.metric, ""))
+        direction = "above" if self.condition == ">" else "below"
+        if self.duration:
+            if self.duration >= 60:
+                duration = format_duration(self.duration)
+            else:
+                duration = f"{self.duration:g} s"
+            body = f"{label} has been {direction} {self.value:g}{unit} for {duration} (now {value:.3g}{unit})"
+        else:
+            body = f"{label} is {value:.3g}{unit} ({direction} {self.value:g}{unit})"
+        return f"⚠️ {self.name}", body
+
+class PollScheduler:
+    """Chooses the delay before the next sample.
+    
+    Starts at the minimum interval and multiplies it by the backoff factor
+    after every stable reading, up to the maximum. A power change of at
+    least change_threshold watts, or a change of battery status, drops it
+    straight back to the minimum. While the session is idle, power changes
+    are ignored and only status changes tighten the interval.
+    """
+    
+    def __init__(self, min_interval, max_interval, backoff, change_threshold, enabled=True):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.backoff = max(1.0, backoff)
+        self.change_threshold = change_threshold
+        self.enabled = enabled
+        self.interval = min_interval
+        self.idle = False
+        self.last_power = None
+        self.last_status = None
+    
+    def next_interval(self, snapshot):
+        """Return the interval in seconds to wait after this snapshot"""
+        if not self.enabled:
+            return self.min_interval
+        
+        power = snapshot.watts
+        status_changed = snapshot.status != self.last_status
+        power_changed = (power is None or self.last_power is None
+                         or abs(power - self.last_power) >= self.change_threshold)
+        self.last_power = power
+        self.last_status = snapshot.status
+        
+        if status_changed or (power_changed and not self.idle):
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+        return self.interval
+
+class SamplingThread:
+    """Takes the readings on a thread of its own.
+    
+    Some embedded controllers take tens of milliseconds to answer a sysfs
+    read, which would freeze the panel and menu if it happened on the GTK
+    main loop. The thread appends each snapshot to pending (a deque, whose
+    append and popleft are atomic, so it is the only writer and the main
+    loop the only reader) and calls notify() to have the main loop drain
+    it. notify() is called at most once per ui_interval and never while an
+    earlier call is still undrained, so readings can come faster than the
+    panel is redrawn without queueing callbacks.
+    
+    A BurstCapture handed to capture() replaces the normal readings while
+    it runs (its error is set instead if the battery cannot be captured);
+    polling carries on with a fresh reading when it ends.
+    """
+    
+    def __init__(self, monitor, notify):
+        self.monitor = monitor   # sampler, scheduler and config are read from it every reading
+        self.notify = notify
+        self.pending = deque(maxlen=4096)
+        self.interval = None
+        self.paused = False
+        self.notified = False
+        self.forced = False
+        self.next_notify = 0.0
+        self.stopped = False
+        self.burst = None   # (BurstCapture, done callback) waiting to run
+        self.wakeup = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="sampler", daemon=True)
+    
+    def start(self, interval):
+        """Take the first reading interval seconds from now"""
+        self.interval = interval
+        self.thread.start()
+    
+    def run(self):
+        monitor = self.monitor
+        while True:
+            self.wakeup.wait(None if self.paused else self.interval)
+            self.wakeup.clear()
+            if self.stopped:
+                return
+            if self.burst is not None:
+                capture, done = self.burst
+                try:
+                    capture.check(self.read_power)
+                    capture.run(self.read_power, lambda: self.stopped)
+                except ValueError as e:
+                    capture.error = str(e)
+                self.burst = None
+                done(capture)
+                if self.stopped:
+                    return
+                self.forced = True
+            if self.paused:
+                continue
+            
+            with monitor.sampler_lock:
+                snapshot = monitor.sampler.sample()
+            self.pending.append(snapshot)
+            self.interval = monitor.scheduler.next_interval(snapshot)
+            
+            now = time.monotonic()
+            if not self.notified and (self.forced or now >= self.next_notify):
+                self.notified = True
+                self.forced = False
+                self.next_notify = now + monitor.config['ui_interval']
+                self.notify()
+    
+    def read_power(self):
+        with self.monitor.sampler_lock:
+            return self.monitor.sampler.read_power()
+    
+    def capture(self, capture, done):
+        """Run capture on this thread next, then call done(capture) here"""
+        self.burst = (capture, done)
+        self.wakeup.set()
+    
+    def drain(self):
+        """Remove and return the readings taken since the last drain"""
+        # Cleared first, so a reading appended during the drain notifies again
+        self.notified = False
+        snapshots = []
+        while True:
+            try:
+                snapshots.append(self.pending.popleft())
+            except IndexError:
+                return snapshots
+    
+    def wake(self):
+        """Take a reading now and show it without waiting for ui_interval"""
+        self.forced = True
+        self.wakeup.set()
+    
+    def stop(self):
+        self.stopped = True
+        self.wakeup.set()
+        self.thread.join(2)
+
+CAPTURE_DIR = LOG_DIR / "captures"
+
+class BurstCapture:
+    """Power at a high rate for a short time, for profiling single events.
+    
+    Times and readings go into arrays allocated up front, so a sample is
+    one sysfs read and two array stores. run() keeps to a fixed schedule
+    (sample n is due n / rate seconds after the start) and skips ahead
+    rather than catching up when a read runs late. Unreadable samples are
+    left out, so size can end up below count.
+    """
+    
+    MAX_RATE = 1000
+    MAX_SAMPLES = 1_000_000
+    
+    def __init__(self, duration, rate):
+        if duration <= 0:
+            raise ValueError("capture duration must be positive")
+        if not 0 < rate <= self.MAX_RATE:
+            raise ValueError(f"capture rate must be between 0 and {self.MAX_RATE} Hz")
+        count = int(duration * rate)
+        if not 0 < count <= self.MAX_SAMPLES:
+            raise ValueError(f"a capture must have between 1 and {self.MAX_SAMPLES} samples, not {count}")
+        
+        self.duration = duration
+        self.rate = rate
+        self.count = count
+        self.times = array('d', bytes(8 * count))   # seconds since started
+        self.power = array('q', bytes(8 * count))   # µW
+        self.size = 0
+        self.started = None
+        self.path = None
+        self.error = None
+    
+    def check(self, read_power):
+        """Raise ValueError if read_power() has no instantaneous reading"""
+        if read_power() is None:
+            raise ValueError("the battery reports neither power_now nor voltage_now and current_now")
+    
+    def run(self, read_power, cancelled=lambda: False):
+        """Take the samples, returning early once cancelled() is true"""
+        times = self.times
+        power = self.power
+        period = 1 / self.rate
+        size = 0
+        self.started = time.time()
+        start = time.monotonic()
+        
+        tick = 0
+        try:
+            while tick < self.count and not cancelled():
+                delay = start + tick * period - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                now = time.monotonic()
+                value = read_power()
+                if value is not None:
+                    times[size] = now - start
+                    power[size] = value
+                    size += 1
+                tick = max(tick + 1, int((time.monotonic() - start) * self.rate))
+        finally:
+            # Interrupted captures keep what they have
+            self.size = size
+    
+    def summary(self):
+        """Energy (trapezoidal), mean and peak power of the samples"""
+        size = self.size
+        times = self.times
+        power = self.power
+        energy = 0.0
+        for index in range(1, size):
+            energy += (power[index - 1] + power[index]) * (times[index] - times[index - 1])
+        energy /= 2e6
+        
+        span = times[size - 1] - times[0] if size else 0.0
+        data = {
+            "started": self.started,
+            "rate_hz": self.rate,
+            "samples": size,
+            "duration_s": span,
+            "energy_j": energy,
+        }
+        if size:
+            data.update({
+                "mean_w": energy / span if span > 0 else power[0] / 1e6,
+                "peak_w": max(power[:size]) / 1e6,
+                "min_w": min(power[:size]) / 1e6,
+            })
+        return data
+    
+    def describe(self):
+        """The summary as one line"""
+        data = self.summary()
+        if not data["samples"]:
+            return "no readings"
+        return (f"{data['energy_j']:.1f} J over {data['duration_s']:.1f} s, "
+                f"mean {data['mean_w']:.2f} W, peak {data['peak_w']:.2f} W")
+    
+    def save(self, directory=CAPTURE_DIR):
+        """Write the trace as CSV and the summary as JSON next to it; returns the CSV path"""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        name = "capture-" + time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started))
+        self.path = directory / f"{name}.csv"
+        
+        times = self.times
+        power = self.power
+        with open(self.path, "w") as f:
+            f.write("time_s,power_w\n")
+            f.writelines(f"{times[index]:.4f},{power[index] / 1e6:.3f}\n"
+                         for index in range(self.size))
+        with open(directory / f"{name}.json", "w") as f:
+            json.dump(self.summary(), f, indent=2)
+        return self.path
+
+POWERCAP_ROOT = "/sys/class/powercap"
+
+class ProcessAttribution:
+    """Splits the power draw between processes by the CPU time they use.
+    
+    A worker thread scans /proc/<pid>/stat every interval seconds and keeps
+    each process's CPU time from the previous scan, so a scan only needs
+    the difference. The power being split is the RAPL package power when
+    /sys/class/powercap is readable, otherwise the battery power above its
+    5 minute minimum (standing in for idle power). Each process gets a
+    share proportional to its CPU time since the previous scan.
+    
+    The monitor writes reading and the thread publishes top, each as a
+    single tuple, so neither side needs a lock or waits for the other.
+    """
+    
+    def __init__(self, interval, top):
+        self.interval = interval
+        self.top_count = top
+        self.reading = (None, None)   # (battery watts, idle watts)
+        self.top = ()                 # ((name, pid, cpu percent, watts), ...)
+        self.baselines = {}           # pid -> (start time, CPU ticks, name)
+        self.last_scan = None
+        self.clock_ticks = os.sysconf("SC_CLK_TCK")
+        self.rapl = self.find_rapl()
+        self.rapl_energy = None
+        
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="process-attribution", daemon=True)
+        self.thread.start()
+    
+    def find_rapl(self):
+        """(energy_uj path, wrap-around range) of each readable RAPL package"""
+        domains = []
+        try:
+            names = sorted(os.listdir(POWERCAP_ROOT))
+        except OSError:
+            return domains
+        
+        for name in names:
+            # Packages only (intel-rapl:0); their subzones (intel-rapl:0:0) are included in them
+            if not name.startswith("intel-rapl:") or name.count(":") != 1:
+                continue
+            path = os.path.join(POWERCAP_ROOT, name)
+            try:
+                with open(os.path.join(path, "energy_uj")) as f:
+                    int(f.read())
+                with open(os.path.join(path, "max_energy_range_uj")) as f:
+                    wrap = int(f.read())
+            except (OSError, ValueError):
+                # energy_uj is root-only on most current kernels
+                continue
+            domains.append((os.path.join(path, "energy_uj"), wrap))
+        return domains
+    
+    def read_rapl(self, elapsed):
+        """Package power in watts since the previous call, or None"""
+        if not self.rapl:
+            return None
+        
+        energy = []
+        for path, wrap in self.rapl:
+            try:
+                with open(path) as f:
+                    energy.append(int(f.read()))
+            except (OSError, ValueError):
+                self.rapl = []
+                return None
+        
+        previous, self.rapl_energy = self.rapl_energy, energy
+        if previous is None:
+            return None
+        total = sum((now - before) % wrap for now, before, (path, wrap)
+                    in zip(energy, previous, self.rapl))
+        return total / 1e6 / elapsed
+    
+    def run(self):
+        while True:
+            try:
+                self.scan()
+            except Exception as e:
+                print(f"Error scanning processes: {e}")
+            if self.stopped.wait(self.interval):
+                return
+    
+    def scan(self):
+        """Read the CPU time of every process and publish the top users"""
+        now = time.monotonic()
+        baselines = {}
+        usage = []
+        for entry in os.scandir("/proc"):
+            if not entry.name.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry.name}/stat", "rb") as f:
+                    data = f.read()
+            except OSError:
+                continue
+            
+            # The name may contain spaces and parentheses; the fields after
+            # the last ")" start at field 3 (state), and only the first 20
+            # of them are split: utime, stime and the start time
+            end = data.rfind(b")")
+            fields = data[end + 2:].split(None, 20)
+            ticks = int(fields[11]) + int(fields[12])
+            started = fields[19]
+            pid = int(entry.name)
+            
+            previous = self.baselines.get(pid)
+            if previous is not None and previous[0] == started:
+                delta = ticks - previous[1]
+                name = previous[2]
+            else:
+                # New since the last scan (or a reused pid): all its time is new
+                delta = ticks if self.last_scan is not None else 0
+                name = data[data.find(b"(") + 1:end]
+            baselines[pid] = (started, ticks, name)
+            if delta > 0:
+                usage.append((delta, pid, name))
+        self.baselines = baselines
+        
+        if self.last_scan is not None:
+            elapsed = now - self.last_scan
+            busy = sum(delta for delta, pid, name in usage)
+            watts = self.attributable_power(elapsed)
+            self.top = tuple(
+                (name.decode('utf-8', 'replace'), pid,
+                 100 * delta / self.clock_ticks / elapsed,
+                 watts * delta / busy if watts is not None else None)
+                for delta, pid, name in heapq.nlargest(self.top_count, usage)
+            )
+        self.last_scan = now
+    
+    def attributable_power(self, elapsed):
+        """Watts to split between the processes, or None if unknown"""
+        rapl = self.read_rapl(elapsed)
+        watts, idle = self.reading
+        if rapl is not None:
+            return rapl if watts is None else min(rapl, watts)
+        if watts is None or idle is None:
+            return None
+        return max(watts - idle, 0)
+    
+    def summary(self, count=3):
+        """The top processes as one line, e.g. firefox 6.1 W, Xorg 2.0 W"""
+        parts = []
+        for name, pid, cpu, watts in self.top[:count]:
+            parts.append(f"{name} {watts:.1f} W" if watts is not None else f"{name} {cpu:.0f}% CPU")
+        return ", ".join(parts)
+    
+    def stop(self):
+        self.stopped.set()
+
+def context_switches():
+    """Times any thread of this process was scheduled out (its wakeups)"""
+    switches = 0
+    for task in os.listdir("/proc/self/task"):
+        try:
+            with open(f"/proc/self/task/{task}/status") as f:
+                for line in f:
+                    if line.startswith(("voluntary_ctxt_switches", "nonvoluntary_ctxt_switches")):
+                        switches += int(line.split()[1])
+        except OSError:
+            pass
+    return switches
+
+def resident_memory():
+    """Resident set size of this process in bytes"""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+class TickInstruments:
+    """Cost of every monitor tick, in fixed-size log-scale histograms.
+    
+    Wall and CPU time per tick are counted in buckets growing by 2^(1/4)
+    from 1 µs, so percentiles are accurate to within 19% and memory stays
+    constant however long the monitor runs. Memory use and wakeups are
+    read from /proc only when a report is made.
+    """
+    
+    BUCKETS = 96  # the last one starts at 2^24 µs (17 s)
+    
+    def __init__(self):
+        self.wall = array('Q', bytes(8 * self.BUCKETS))
+        self.cpu = array('Q', bytes(8 * self.BUCKETS))
+        self.ticks = 0
+        self.reads = 0
+        self.last_reads = None
+        self.wall_total = 0
+        self.cpu_total = 0
+        self.started = time.monotonic()
+        self.started_cpu = time.process_time()
+        self.started_switches = context_switches()
+    
+    def bucket(self, nanoseconds):
+        if nanoseconds < 1000:
+            return 0
+        return min(int(4 * math.log2(nanoseconds / 1000)) + 1, self.BUCKETS - 1)
+    
+    def measure(self, update, sampler):
+        """Run update() and record its wall time, CPU time and sysfs reads.
+        
+        Reads are counted since the previous tick rather than during
+        update(), so those made by the sampling thread are included.
+        """
+        cpu = time.thread_time_ns()
+        wall = time.perf_counter_ns()
+        update()
+        wall = time.perf_counter_ns() - wall
+        cpu = time.thread_time_ns() - cpu
+        
+        self.ticks += 1
+        reads = sampler.reads
+        if self.last_reads is not None:
+            # A replaced sampler starts counting from zero again
+            self.reads += max(reads - self.last_reads, 0)
+        self.last_reads = reads
+        self.wall_total += wall
+        self.cpu_total += cpu
+        self.wall[self.bucket(wall)] += 1
+        self.cpu[self.bucket(cpu)] += 1
+    
+    def percentile(self, histogram, fraction):
+        """Upper edge of the bucket holding the fraction quantile, in µs"""
+        rank = fraction * self.ticks
+        seen = 0
+        for index, count in enumerate(histogram):
+            seen += count
+            if count and seen >= rank:
+                return 2 ** (index / 4)
+        return None
+    
+    def report(self):
+        """Tick cost percentiles and the monitor's overall footprint"""
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        minutes = elapsed / 60
+        data = {
+            "ticks": self.ticks,
+            "uptime_s": elapsed,
+            "rss_bytes": resident_memory(),
+            "wakeups_per_min": (context_switches() - self.started_switches) / minutes,
+            "ticks_per_min": self.ticks / minutes,
+            # CPU of the whole process (GTK included) and of the ticks alone,
+            # as a percentage of one core
+            "cpu_percent": 100 * (time.process_time() - self.started_cpu) / elapsed,
+            "tick_cpu_percent": 100 * self.cpu_total / 1e9 / elapsed,
+        }
+        if self.ticks:
+            data.update({
+                "tick_wall_us": {"p50": self.percentile(self.wall, 0.5),
+                                 "p99": self.percentile(self.wall, 0.99),
+                                 "mean": self.wall_total / self.ticks / 1000},
+                "tick_cpu_us": {"p50": self.percentile(self.cpu, 0.5),
+                                "p99": self.percentile(self.cpu, 0.99),
+                                "mean": self.cpu_total / self.ticks / 1000},
+                "sysfs_reads_per_tick": self.reads / self.ticks,
+            })
+        return data
+
+class MonitorCore:
+    """Sampling, history, statistics and alerts without any user interface.
+    
+    The tray indicator and the headless daemon both build on this; it only
+    needs the standard library. A profiling run (profile set) may run next
+    to a live monitor, so it writes no files: no power log, energy totals
+    or default config, and no process attribution.
+    """
+    
+    def __init__(self, profile=None):
+        self.profile = profile
+        self.config = self.load_config()
+        self.mark("config")
+        self.supplies = discover_power_supplies()
+        self.sampler = self.create_sampler(self.config)
+        # Held while the sampler reads, so it is never replaced mid-reading
+        self.sampler_lock = threading.Lock()
+        self.mark("power supplies and sampler")
+        self.snapshot = None
+        self.history = PowerHistory(self.config['history_size'])
+        self.stats = RollingStats(self.history)
+        self.estimator = TimeEstimator(self.stats)
+        self.estimate = None
+        self.power_log = self.create_power_log(self.config)
+        self.alert_rules = self.create_alert_rules(self.config)
+        self.scheduler = self.create_scheduler(self.config)
+        self.instruments = TickInstruments() if self.config['instrumentation'] else None
+        self.graph = PowerGraph() if self.config['show_graph'] else None
+        self.attribution = self.create_attribution(self.config)
+        self.energy = self.create_energy_account(self.config)
+        self.mark("history, statistics and log")
+    
+    def mark(self, phase):
+        """Record the end of a startup phase when profiling"""
+        if self.profile is not None:
+            self.profile.mark(phase)
+    
+    @staticmethod
+    def load_config():
+        """Load configuration from file or use defaults"""
+        if CONFIG_FILE.exists():
+            try:
+                with open(CONFIG_FILE, 'r') as f:
+                    # Merge with defaults
+                    config = merge_config(json.load(f))
+            except Exception as e:
+                print(f"Error loading config: {e}, using defaults")
+            else:
+                problems = validate_config(config)
+                if not problems:
+                    return config
+                print("Invalid config, using defaults:\n  " + "\n  ".join(problems))
+        return copy.deepcopy(CONFIG)
+    
+    def write_default_config(self):
+        """Create the config file with the defaults if there is none yet"""
+        if self.profile is None and not CONFIG_FILE.exists():
+            self.save_config(CONFIG)
+    
+    def save_config(self, config):
+        """Save configuration to file"""
+        CONFIG_FILE.parent.mkdir(exist_ok=True)
+        
+        try:
+            with open(CONFIG_FILE, 'w') as f:
+                json.dump(config, f, indent=4)
+        except Exception as e:
+            print(f"Error saving config: {e}")
+    
+    def reload_config(self):
+        """Validate the config file and apply only the settings that changed"""
+        try:
+            with open(CONFIG_FILE, 'r') as f:
+                config = merge_config(json.load(f))
+        except Exception as e:
+            print(f"Error reloading config: {e}, keeping current settings")
+            return
+        
+        problems = validate_config(config)
+        if problems:
+            print("Invalid config, keeping current settings:\n  " + "\n  ".join(problems))
+            return
+        
+        changed = {key for key in config if config[key] != self.config.get(key)}
+        if not changed:
+            return
+        
+        # Nothing running changes until everything the new settings need
+        # has been built
+        try:
+            state = self.prepare_config(config, changed)
+        except Exception as e:
+            print(f"Error applying config: {e}, keeping current settings")
+            return
+        
+        self.config = config
+        self.apply_config(changed, state)
+    
+    def prepare_config(self, config, changed):
+        """Build the sampling state the changed keys need, as {attribute: value}.
         
-        # Start updating
-        self.update_power()
-        GLib.timeout_add_seconds(self.config['update_interval'], self.update_power)
+        The running state is left alone; if anything fails, what was already
+        built is released and the exception propagates.
+        """
+        state = {}
+        try:
+            if "battery_device" in changed:
+                state['sampler'] = self.create_sampler(config)
+            
+            if "history_size" in changed:
+                history = PowerHistory(config['history_size'])
+                state['history'] = history
+                state['stats'] = RollingStats(history)
+                state['estimator'] = TimeEstimator(state['stats'])
+                state['estimate'] = None
+            
+            if "show_graph" in changed:
+                state['graph'] = PowerGraph() if config['show_graph'] else None
+            
+            if "power_log" in changed:
+                state['power_log'] = self.create_power_log(config)
+            
+            if changed & {"notify_high_power", "alert_rules"}:
+                state['alert_rules'] = self.create_alert_rules(config)
+            
+            if changed & {"update_interval", "adaptive_polling"}:
+                state['scheduler'] = self.create_scheduler(config)
+            
+            if "instrumentation" in changed:
+                state['instruments'] = TickInstruments() if config['instrumentation'] else None
+            
+            # Started last: it is the only one running a thread
+            if "process_attribution" in changed:
+                state['attribution'] = self.create_attribution(config)
+        except Exception:
+            if state.get('sampler') is not None:
+                state['sampler'].close()
+            if state.get('power_log') is not None:
+                state['power_log'].close()
+            raise
+        return state
     
-    def load_config(self):
-        """Load configuration from file or use defaults"""
-        config_file = Path.home() / ".config" / "battery-power-monitor.json"
+    def apply_config(self, changed, state):
+        """Swap in the state prepare_config() built, releasing what it replaces"""
+        if "sampler" in state:
+            with self.sampler_lock:
+                self.sampler.close()
+                self.sampler = state['sampler']
+        elif changed & {"show_voltage", "show_current", "power_log",
+                        "show_time_estimate", "label_time_estimate"}:
+            # Keep the probed source and counter baselines of the sampler
+            with self.sampler_lock:
+                self.configure_sampler(self.sampler, self.config)
         
-        if config_file.exists():
-            try:
-                with open(config_file, 'r') as f:
-                    user_config = json.load(f)
-                    # Merge with defaults
-                    config = CONFIG.copy()
-                    config.update(user_config)
-                    return config
-            except Exception as e:
-                print(f"Error loading config: {e}, using defaults")
+        if "power_log" in state and self.power_log is not None:
+            self.power_log.close()
+        if "attribution" in state and self.attribution is not None:
+            self.attribution.stop()
+        if "scheduler" in state:
+            state['scheduler'].idle = self.scheduler.idle
         
-        # Save default config
-        self.save_config(CONFIG)
-        return CONFIG
-    
-    def save_config(self, config):
-        """Save configuration to file"""
-        config_dir = Path.home() / ".config"
-        config_dir.mkdir(exist_ok=True)
-        config_file = config_dir / "battery-power-monitor.json"
+        for name, value in state.items():
+            setattr(self, name, value)
         
-        try:
-            with open(config_file, 'w') as f:
-                json.dump(config, f, indent=4)
-        except Exception as e:
-            print(f"Error saving config: {e}")
+        if "graph" in state and self.graph is not None:
+            self.graph.fill(self.history)
+        
+        # The new account loads the totals the old one has just saved
+        if "energy_accounting" in changed:
+            if self.energy is not None:
+                self.energy.checkpoint()
+            self.energy = self.create_energy_account(self.config)
     
-    def get_icon_name(self):
-        """Get icon based on configuration"""
-        icons = {
-            "battery": "battery",
-            "power": "system-shutdown",
-            "bolt": "weather-storm",
-            "chip": "computer"
-        }
-        return icons.get(self.config['icon_style'], "battery")
+    def create_scheduler(self, config):
+        adaptive = config['adaptive_polling']
+        return PollScheduler(
+            config['update_interval'],
+            adaptive['max_interval'],
+            adaptive['backoff'],
+            adaptive['change_threshold'],
+            adaptive['enabled']
+        )
     
-    def read_battery_value(self, filename):
-        """Read a value from battery sysfs"""
-        try:
-            with open(f"{self.battery_path}/{filename}", 'r') as f:
-                return int(f.read().strip())
-        except:
+    def create_attribution(self, config):
+        """Process power attribution, or None when it is disabled"""
+        attribution_config = config['process_attribution']
+        if not attribution_config['enabled'] or self.profile is not None:
             return None
+        return ProcessAttribution(attribution_config['interval'], attribution_config['top'])
     
-    def read_battery_string(self, filename):
-        """Read a string from battery sysfs"""
-        try:
-            with open(f"{self.battery_path}/{filename}", 'r') as f:
-                return f.read().strip()
-        except:
+    def create_energy_account(self, config):
+        """Energy totals, or None when accounting is disabled"""
+        energy_config = config['energy_accounting']
+        if not energy_config['enabled'] or self.profile is not None:
             return None
+        return EnergyAccount(energy_config['checkpoint_interval'])
     
-    def get_power_draw(self):
-        """Calculate current power draw in watts"""
-        voltage = self.read_battery_value("voltage_now")
-        current = self.read_battery_value("current_now")
-        
-        if voltage is None or current is None:
+    def create_power_log(self, config):
+        """Power log writer, or None when logging is disabled"""
+        log_config = config['power_log']
+        if not log_config['enabled'] or self.profile is not None:
             return None
+        return PowerLogWriter(
+            LOG_DIR,
+            log_config['flush_interval'],
+            log_config['fsync_interval'],
+            int(log_config['segment_mb'] * (1 << 20)),
+            log_config['segment_hours'] * 3600,
+            log_config['keep_days'] * 86400
+        )
+    
+    def create_sampler(self, config):
+        """Sampler for the configured device, or for all batteries"""
+        sampler = open_sampler(config['battery_device'], self.supplies)
+        self.configure_sampler(sampler, config)
+        return sampler
+    
+    def configure_sampler(self, sampler, config):
+        """Tell the sampler's batteries which optional attributes to read"""
+        batteries = sampler.batteries.values() if isinstance(sampler, SupplyGroupSampler) else (sampler,)
+        for battery in batteries:
+            battery.read_details = self.needs_details(config)
+            battery.read_energy = self.needs_energy(config)
+    
+    @staticmethod
+    def needs_details(config):
+        """Whether voltage and current are used even when power_now exists"""
+        return config['show_voltage'] or config['show_current'] or config['power_log']['enabled']
+    
+    @staticmethod
+    def needs_energy(config):
+        """Whether remaining energy is read for time estimates"""
+        return config['show_time_estimate'] or config['label_time_estimate']
+    
+    def refresh_supplies(self):
+        """Rediscover power supplies after a hotplug event.
+        
+        Returns True when the set of supplies changed.
+        """
+        supplies = discover_power_supplies()
+        if supplies == self.supplies:
+            return False
         
-        # Calculate power in watts
-        power = (voltage * current) / 1_000_000_000_000
-        return power
+        self.supplies = supplies
+        with self.sampler_lock:
+            self.sampler.close()
+            self.sampler = self.create_sampler(self.config)
+        return True
+    
+    def create_alert_rules(self, config):
+        """Build the enabled alert rules, including the high power alert"""
+        rules = []
+        notify_config = config['notify_high_power']
+        if notify_config['enabled']:
+            rules.append(AlertRule(
+                "High Power Draw", "power", ">", notify_config['threshold'],
+                cooldown=notify_config['cooldown']
+            ))
+        
+        for rule in config['alert_rules']:
+            if not rule.get('enabled', True):
+                continue
+            rules.append(AlertRule.from_config(rule))
+        return rules
+    
+    def check_alerts(self, snapshot):
+        """Report every alert rule that fires"""
+        for rule in self.alert_rules:
+            value = rule.evaluate(snapshot, self.stats)
+            if value is not None:
+                title, message = rule.message(value)
+                if self.attribution is not None and self.attribution.top:
+                    message += f"\nTop: {self.attribution.summary()}"
+                self.alert(title, message)
+    
+    def alert(self, title, message):
+        print(f"{title}: {message}")
+    
+    def run_update(self, update):
+        """Call update(), measuring it when instrumentation is enabled"""
+        if self.instruments is None:
+            update()
+        else:
+            self.instruments.measure(update, self.sampler)
+    
+    def take_sample(self):
+        """Read the battery and feed history, statistics and the power log"""
+        return self.record(self.sampler.sample())
     
-    def get_power_color(self, power):
+    def record(self, snapshot):
+        """Feed a reading to history, statistics, the power log and the graph"""
+        self.snapshot = snapshot
+        self.history.append(snapshot)
+        self.stats.update()
+        if self.needs_energy(self.config):
+            self.estimate = self.estimator.update(snapshot)
+        if self.power_log is not None:
+            self.power_log.append(snapshot)
+        if self.graph is not None and snapshot.power is not None:
+            self.graph.append(snapshot.timestamp, snapshot.watts)
+        if self.energy is not None:
+            self.energy.add(snapshot)
+        if self.attribution is not None:
+            # While charging the battery reading is not the system's draw, and
+            # the minimum only approximates idle power once it covers 5 minutes
+            if snapshot.status == "Charging":
+                self.attribution.reading = (None, None)
+            elif snapshot.timestamp - self.history.timestamp_at(0) >= 300:
+                self.attribution.reading = (snapshot.watts, self.stats.windows[300].minimum())
+            else:
+                self.attribution.reading = (snapshot.watts, None)
+        return snapshot
+    
+    def display_power(self, snapshot):
+        """Power shown in the panel: the reading, or its 10 s average"""
+        if self.config['display_format'] == "smoothed":
+            smoothed = self.stats.ema[10]
+            if smoothed is not None:
+                return smoothed
+        return snapshot.watts
+    
+    def get_power_color(self, snapshot):
         """Get color emoji/indicator based on power level"""
         if not self.config['color_coding']['enabled']:
             return ""
         
         thresholds = self.config['color_coding']
+        power = self.display_power(snapshot)
         
         if power < thresholds['low']:
             return "🟢"
@@ -158,70 +2856,712 @@ class BatteryPowerMonitor:
         else:
             return "🔴"
     
-    def format_power_label(self, power):
+    def format_power_label(self, snapshot):
         """Format power reading for display"""
         decimals = self.config['decimal_places']
+        power = self.display_power(snapshot)
         
         if self.config['display_format'] == "short":
-            return f"{power:.{decimals}f}W"
+            label = f"{power:.{decimals}f}W"
+        elif self.config['display_format'] == "smoothed":
+            label = f"~{power:.{decimals}f}W"
         else:
-            return f"Power: {power:.{decimals}f}W"
+            label = f"Power: {power:.{decimals}f}W"
+        
+        if self.config['label_time_estimate'] and self.estimate is not None:
+            label += f" {format_duration(self.estimate[1], compact=True)}"
+        return label
     
-    def check_high_power_notification(self, power):
-        """Send notification if power is too high"""
-        notify_config = self.config['notify_high_power']
+    def snapshot_dict(self):
+        """The latest snapshot and derived values as plain JSON data"""
+        snapshot = self.snapshot
+        if snapshot is None:
+            return None
         
-        if not notify_config['enabled']:
-            return
+        data = {
+            "timestamp": snapshot.timestamp,
+            "power_w": snapshot.watts,
+            "voltage_uv": snapshot.voltage,
+            "current_ua": snapshot.current,
+            "status": snapshot.status,
+            "capacity": snapshot.capacity,
+            "ac_online": snapshot.ac_online,
+            "batteries": {name: {"power_w": pack.watts, "status": pack.status,
+                                 "capacity": pack.capacity}
+                          for name, pack in snapshot.packs},
+            "averages_w": {f"{seconds}s": value for seconds, value in self.stats.ema.items()},
+        }
         
-        if power < notify_config['threshold']:
-            return
+        window = self.stats.windows[300]
+        if window.size:
+            data["window_5min_w"] = {"min": window.minimum(), "max": window.maximum(),
+                                     "mean": window.mean(), "p95": window.percentile(0.95)}
+        if self.estimate is not None:
+            mode, seconds, low, high = self.estimate
+            data["time_to_" + mode] = {"seconds": seconds, "low": low, "high": high}
+        if self.energy is not None:
+            data["energy"] = self.energy.report()
+        if self.attribution is not None:
+            data["top_processes"] = [{"name": name, "pid": pid, "cpu_percent": cpu, "power_w": watts}
+                                     for name, pid, cpu, watts in self.attribution.top]
+        return data
+    
+    def metrics_text(self):
+        """The latest snapshot and derived values in Prometheus text format"""
+        lines = []
+        
+        def escape(label):
+            return str(label).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        
+        def metric(name, kind, description, samples):
+            samples = [(labels, value) for labels, value in samples if value is not None]
+            if not samples:
+                return
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                # Full precision: counters must keep moving past a million
+                value = str(value) if isinstance(value, int) else repr(float(value))
+                if labels:
+                    labels = ",".join(f'{key}="{escape(label)}"' for key, label in labels.items())
+                    lines.append(f"{name}{{{labels}}} {value}")
+                else:
+                    lines.append(f"{name} {value}")
+        
+        metric("battery_samples_total", "counter", "Readings taken since start",
+               [({}, self.history.total)])
+        
+        snapshot = self.snapshot
+        if snapshot is not None:
+            metric("battery_power_watts", "gauge", "Battery power draw",
+                   [({}, snapshot.watts)])
+            metric("battery_voltage_volts", "gauge", "Battery voltage",
+                   [({}, snapshot.voltage / 1e6 if snapshot.voltage is not None else None)])
+            metric("battery_current_amps", "gauge", "Battery current",
+                   [({}, snapshot.current / 1e6 if snapshot.current is not None else None)])
+            metric("battery_capacity_percent", "gauge", "Battery charge level",
+                   [({}, snapshot.capacity)])
+            metric("battery_status", "gauge", "Battery charging status (1 for the current one)",
+                   [({"status": name}, float(name == snapshot.status)) for name in STATUS_CODES])
+            if snapshot.ac_online is not None:
+                metric("battery_ac_online", "gauge", "Whether an AC adapter is online",
+                       [({}, float(snapshot.ac_online))])
+            metric("battery_pack_power_watts", "gauge", "Power draw of each battery",
+                   [({"battery": name}, pack.watts) for name, pack in snapshot.packs])
+            metric("battery_pack_capacity_percent", "gauge", "Charge level of each battery",
+                   [({"battery": name}, pack.capacity) for name, pack in snapshot.packs])
+        
+        metric("battery_power_average_watts", "gauge", "Exponential moving average of power",
+               [({"window": f"{seconds}s"}, value) for seconds, value in self.stats.ema.items()])
+        
+        samples = []
+        for seconds, window in self.stats.windows.items():
+            if window.size:
+                labels = {"window": f"{seconds}s"}
+                samples += [({**labels, "stat": "min"}, window.minimum()),
+                            ({**labels, "stat": "max"}, window.maximum()),
+                            ({**labels, "stat": "mean"}, window.mean()),
+                            ({**labels, "stat": "p95"}, window.percentile(0.95))]
+        metric("battery_power_window_watts", "gauge", "Power statistics over a sliding window",
+               samples)
+        
+        if self.estimate is not None:
+            mode, seconds, low, high = self.estimate
+            metric("battery_time_remaining_seconds", "gauge", "Estimated time to empty or full",
+                   [({"mode": mode, "bound": "estimate"}, seconds),
+                    ({"mode": mode, "bound": "low"}, low),
+                    ({"mode": mode, "bound": "high"}, high)])
+        
+        if self.energy is not None:
+            totals = self.energy.report()
+            for key, description in (("discharged_wh", "Energy drawn from the battery"),
+                                     ("charged_wh", "Energy charged into the battery")):
+                metric(f"battery_energy_{key}", "gauge", f"{description} in the period",
+                       [({"period": period}, total[key]) for period, total in totals.items()
+                        if total is not None])
         
-        import time
-        current_time = time.time()
+        if self.attribution is not None:
+            top = self.attribution.top
+            metric("battery_process_power_watts", "gauge", "Estimated power of the top processes",
+                   [({"process": name, "pid": pid}, watts) for name, pid, cpu, watts in top])
+            metric("battery_process_cpu_percent", "gauge", "CPU use of the top processes",
+                   [({"process": name, "pid": pid}, cpu) for name, pid, cpu, watts in top])
         
-        if current_time - self.last_notification < notify_config['cooldown']:
+        if self.instruments is not None:
+            report = self.instruments.report()
+            if "tick_wall_us" in report:
+                metric("battery_monitor_tick_seconds", "gauge", "Wall time of one monitor tick",
+                       [({"quantile": "0.5"}, report["tick_wall_us"]["p50"] / 1e6),
+                        ({"quantile": "0.99"}, report["tick_wall_us"]["p99"] / 1e6)])
+            metric("battery_monitor_cpu_percent", "gauge", "CPU used by the monitor (% of one core)",
+                   [({}, report["cpu_percent"])])
+            metric("battery_monitor_wakeups_per_minute", "gauge", "Times the monitor was scheduled",
+                   [({}, report["wakeups_per_min"])])
+            metric("battery_monitor_resident_bytes", "gauge", "Resident memory of the monitor",
+                   [({}, report["rss_bytes"])])
+        return "\n".join(lines) + "\n"
+    
+    def close(self):
+        with self.sampler_lock:
+            self.sampler.close()
+        if self.power_log is not None:
+            self.power_log.close()
+        if self.energy is not None:
+            self.energy.checkpoint()
+        if self.attribution is not None:
+            self.attribution.stop()
+
+class HeadlessMonitor(MonitorCore):
+    """Monitor without GTK, driven by a selectors loop.
+    
+    Serves /metrics (Prometheus text) and /json over HTTP. Both are
+    rendered at most once per reading and cached until the next one, so
+    frequent scrapes cost no extra sysfs reads or formatting. SIGHUP
+    reloads the config file; alerts are printed to stdout.
+    """
+    
+    def __init__(self, address=None, port=None, profile=None):
+        super().__init__(profile)
+        self.write_default_config()
+        self.selector = selectors.DefaultSelector()
+        self.running = False
+        self.next_update = time.monotonic()
+        self.responses = {}
+        
+        # A profiling run must not take the port of a running daemon
+        self.server = None
+        if profile is None:
+            metrics = self.config['metrics']
+            self.server = MetricsServer(address if address is not None else metrics['address'],
+                                        port if port is not None else metrics['port'],
+                                        self.selector, self.render)
+        
+        # Signals arrive through a socket so the loop handles them between readings
+        self.wakeup, wakeup_writer = socket.socketpair()
+        self.wakeup.setblocking(False)
+        wakeup_writer.setblocking(False)
+        self.wakeup_writer = wakeup_writer
+        signal.set_wakeup_fd(wakeup_writer.fileno())
+        for signum in (signal.SIGHUP, signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda signum, frame: None)
+        self.selector.register(self.wakeup, selectors.EVENT_READ, self.on_signal)
+        
+        self.uevents = None
+        if self.config['watch_uevents']:
+            self.start_uevents()
+    
+    def apply_config(self, changed, state):
+        super().apply_config(changed, state)
+        
+        if "watch_uevents" in changed:
+            if self.config['watch_uevents']:
+                self.start_uevents()
+            else:
+                self.stop_uevents()
+        
+        if changed & {"update_interval", "adaptive_polling"}:
+            self.next_update = time.monotonic()
+    
+    def start_uevents(self):
+        """Listen for kernel power_supply events"""
+        self.stop_uevents()
+        try:
+            self.uevents = UeventSource()
+        except OSError as e:
+            print(f"Cannot listen for power supply events, polling only: {e}")
+            return
+        self.selector.register(self.uevents, selectors.EVENT_READ, self.on_uevent)
+    
+    def stop_uevents(self):
+        if self.uevents is not None:
+            self.selector.unregister(self.uevents)
+            self.uevents.close()
+            self.uevents = None
+    
+    def on_uevent(self, source):
+        try:
+            events = source.receive()
+        except OSError as e:
+            print(f"Power supply events failed, polling only: {e}")
+            self.stop_uevents()
             return
+        if events:
+            if any(action in ("add", "remove") for action, properties in events):
+                self.refresh_supplies()
+            self.next_update = time.monotonic()
+    
+    def on_signal(self, sock):
+        try:
+            signals = sock.recv(64)
+        except BlockingIOError:
+            return
+        if signal.SIGHUP in signals:
+            self.reload_config()
+        if signal.SIGINT in signals or signal.SIGTERM in signals:
+            self.running = False
+    
+    def render(self, path):
+        """Cached (content type, body) for path, or None if there is no such page"""
+        response = self.responses.get(path)
+        if response is not None:
+            return response
         
+        if path == "/metrics":
+            response = ("text/plain; version=0.0.4; charset=utf-8", self.metrics_text().encode())
+        elif path == "/json":
+            response = ("application/json", json.dumps(self.snapshot_dict()).encode())
+        else:
+            return None
+        self.responses[path] = response
+        return response
+    
+    def update(self):
+        """Take a reading and drop the rendered responses of the previous one"""
+        snapshot = self.take_sample()
+        self.responses.clear()
+        if snapshot.power is not None:
+            self.check_alerts(snapshot)
+    
+    def run(self):
+        """Sample and serve until SIGINT or SIGTERM"""
+        self.running = True
         try:
-            import subprocess
-            subprocess.run([
-                'notify-send',
-                '⚠️ High Power Draw',
-                f'Battery is consuming {power:.1f}W',
-                '-u', 'normal',
-                '-t', '5000'
-            ])
-            self.last_notification = current_time
-        except:
-            pass
+            while self.running:
+                timeout = max(self.next_update - time.monotonic(), 0)
+                for key, events in self.selector.select(timeout):
+                    key.data(key.fileobj)
+                
+                now = time.monotonic()
+                if self.running and now >= self.next_update:
+                    self.run_update(self.update)
+                    self.next_update = now + self.scheduler.next_interval(self.snapshot)
+        finally:
+            self.close()
     
-    def update_power(self):
-        """Update power reading and display"""
-        power = self.get_power_draw()
+    def close(self):
+        super().close()
+        self.stop_uevents()
+        if self.server is not None:
+            self.server.close()
+        signal.set_wakeup_fd(-1)
+        self.wakeup.close()
+        self.wakeup_writer.close()
+        self.selector.close()
+
+class BatteryPowerMonitor(MonitorCore):
+    # Pixel size of the menu graphs
+    GRAPH_SIZE = (120, 24)
+    
+    # Seconds between refreshes of the menu's text while it seems closed
+    MENU_REFRESH_INTERVAL = 10
+    
+    def __init__(self, profile=None):
+        super().__init__(profile)
+        self.menu_visible = False
+        # No menu items exist until create_menu()
+        self.next_menu_update = float('inf')
+        self.paused = False
+        self.control = None
+        self.notifier = None
+        self.capture = None
+        self.last_capture = None
         
-        if power is None:
-            self.indicator.set_label("ERR", "")
-            return True
+        # Last label sent to the panel, and how often one was sent or skipped
+        self.last_label = None
+        self.last_color = None
+        self.last_label_power = None
+        self.label_updates = {"issued": 0, "suppressed": 0}
+        
+        # Set up indicator
+        icon = self.get_icon_name()
+        self.indicator = AppIndicator3.Indicator.new(
+            "battery-power-monitor",
+            icon,
+            AppIndicator3.IndicatorCategory.HARDWARE
+        )
+        self.indicator.set_status(AppIndicator3.IndicatorStatus.ACTIVE)
+        
+        # The indicator is only shown once it has a menu; an empty one will
+        # do until finish_startup() builds the real one
+        self.menu = Gtk.Menu()
+        self.indicator.set_menu(self.menu)
+        self.mark("indicator")
+        
+        # Start updating: the first reading is taken here so the label shows
+        # at once, the rest on the sampling thread
+        self.idle_watched = False
+        self.uevents = None
+        self.uevent_watch = None
+        if self.config['watch_uevents']:
+            self.start_uevents()
+        self.run_update(self.update_power)
+        self.sampling = SamplingThread(self, lambda: GLib.idle_add(self.on_samples))
+        self.sampling.start(self.scheduler.next_interval(self.snapshot))
+        self.mark("first reading")
+        
+        # Logout ends the session with SIGHUP or SIGTERM; quit through the
+        # main loop so the energy totals and power log are saved
+        for signum in (signal.SIGHUP, signal.SIGINT, signal.SIGTERM):
+            GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signum, self.on_signal)
+        
+        # Everything the first label does not need waits for the main loop
+        GLib.idle_add(self.finish_startup)
+    
+    def finish_startup(self):
+        """Build the menu and start the session services once idle"""
+        self.create_menu()
+        self.mark("menu")
+        
+        if self.config['adaptive_polling']['enabled'] and not self.idle_watched:
+            self.watch_session_idle()
+        
+        # Apply edits to the config file without a restart
+        self.write_default_config()
+        self.watch_config()
+        
+        # Connect for notifications now, so the first alert goes over D-Bus
+        if self.notifier is None:
+            self.notifier = Notifier()
+        
+        if self.profile is None:
+            self.start_control()
+        self.mark("session bus, config watch and control socket")
+        
+        if self.profile is not None:
+            self.profile.report()
+            self.quit(None)
+        return False
+    
+    def watch_config(self):
+        """Reload the configuration whenever the file changes"""
+        self.config_monitor = Gio.File.new_for_path(str(CONFIG_FILE)).monitor_file(
+            Gio.FileMonitorFlags.NONE, None
+        )
+        self.config_monitor.connect("changed", self.on_config_changed)
+    
+    def on_config_changed(self, monitor, file, other_file, event):
+        # Editors either rewrite in place (CHANGES_DONE_HINT) or rename a
+        # new file over the old one (CREATED)
+        if event in (Gio.FileMonitorEvent.CHANGES_DONE_HINT, Gio.FileMonitorEvent.CREATED):
+            self.reload_config()
+    
+    def apply_config(self, changed, state):
+        """Rebuild only what depends on the changed config keys"""
+        super().apply_config(changed, state)
+        
+        if "icon_style" in changed:
+            self.indicator.set_icon_full(self.get_icon_name(), "Battery power")
+        
+        if (changed & {"battery_device", "instrumentation", "process_attribution", "capture",
+                       "energy_accounting"}
+                or any(key.startswith("show_") for key in changed)):
+            self.create_menu()
+        
+        if "watch_uevents" in changed:
+            if self.config['watch_uevents']:
+                self.start_uevents()
+            else:
+                self.stop_uevents()
+        
+        if changed & {"update_interval", "adaptive_polling"}:
+            if self.config['adaptive_polling']['enabled'] and not self.idle_watched:
+                self.watch_session_idle()
+            self.refresh_now()
+        
+        # Redraw the label with the new formatting on the next reading
+        self.last_label = None
+        self.last_color = None
+    
+    def refresh_supplies(self):
+        """Rediscover power supplies and rebuild the menu if they changed"""
+        if not super().refresh_supplies():
+            return False
+        self.create_menu()
+        return True
+    
+    def get_icon_name(self):
+        """Get icon based on configuration"""
+        icons = {
+            "battery": "battery",
+            "power": "system-shutdown",
+            "bolt": "weather-storm",
+            "chip": "computer"
+        }
+        return icons.get(self.config['icon_style'], "battery")
+    
+    def alert(self, title, message):
+        # Alerts from the first reading come before finish_startup()
+        if self.notifier is None:
+            self.notifier = Notifier()
+        self.notifier.send(title, message)
+    
+    def update_power(self):
+        """Take a reading on the main loop and display it"""
+        self.show_reading(self.take_sample())
+    
+    def on_samples(self):
+        """Take in the readings of the sampling thread (runs on the main loop)"""
+        self.run_update(self.process_samples)
+        return False
+    
+    def process_samples(self):
+        """Record every pending reading and display the latest"""
+        snapshots = self.sampling.drain()
+        if not snapshots or self.paused:
+            return
+        for snapshot in snapshots:
+            self.record(snapshot)
+        # The label says a capture is running until it ends
+        if self.capture is None:
+            self.show_reading(snapshots[-1])
+    
+    def show_reading(self, snapshot):
+        """Update the label and open menu, and check alerts"""
+        if snapshot.power is None:
+            # A counter has no rate until it moves, e.g. for minutes after
+            # AC is plugged in, or at all while full: not an error
+            if snapshot.status is not None and self.sampler.counts_energy:
+                self.set_indicator_label("--", "", None)
+            else:
+                self.set_indicator_label("ERR", "", None)
+            return
         
         # Format label
-        label = self.format_power_label(power)
-        color = self.get_power_color(power)
+        label = self.format_power_label(snapshot)
+        color = self.get_power_color(snapshot)
         
         # Update indicator
-        self.indicator.set_label(f"{color} {label}".strip(), "")
+        self.set_indicator_label(label, color, self.display_power(snapshot))
         
-        # Update menu items
-        self.update_menu_items()
+        # Menu items are refreshed on every reading while the menu is open.
+        # A panel showing it over dbusmenu does not always emit "show" on
+        # this GtkMenu (and AppIndicator keeps its dbusmenu server private),
+        # so the text labels are also kept fresh, less often, while it looks
+        # closed; graphs, processes and diagnostics wait for "show".
+        if self.menu_visible:
+            self.update_menu_items(snapshot)
+        else:
+            now = time.monotonic()
+            if now >= self.next_menu_update:
+                self.update_menu_items(snapshot, full=False)
+                self.next_menu_update = now + self.MENU_REFRESH_INTERVAL
         
         # Check for notifications
-        self.check_high_power_notification(power)
+        self.check_alerts(snapshot)
+    
+    def set_indicator_label(self, label, color, power):
+        """Send a label to the panel unless nothing visible changed.
+        
+        Each set_label is a D-Bus round trip, so identical labels are
+        skipped, and with label_hysteresis a label is kept while power stays
+        within the band around the last value shown (a colour change always
+        goes through).
+        """
+        if color == self.last_color:
+            if label == self.last_label:
+                self.label_updates["suppressed"] += 1
+                return
+            
+            hysteresis = self.config['label_hysteresis']
+            if (hysteresis > 0 and power is not None and self.last_label_power is not None
+                    and abs(power - self.last_label_power) < hysteresis):
+                self.label_updates["suppressed"] += 1
+                return
         
+        self.indicator.set_label(f"{color} {label}".strip(), "")
+        self.last_label = label
+        self.last_color = color
+        self.last_label_power = power
+        self.label_updates["issued"] += 1
+    
+    def start_uevents(self):
+        """Listen for kernel power_supply events"""
+        try:
+            self.watch_uevents(UeventSource())
+        except OSError as e:
+            print(f"Cannot listen for power supply events, polling only: {e}")
+    
+    def stop_uevents(self):
+        if self.uevents is not None:
+            GLib.source_remove(self.uevent_watch)
+            self.uevents.close()
+            self.uevents = None
+    
+    def watch_uevents(self, source):
+        """Refresh immediately whenever source reports a power_supply event"""
+        self.stop_uevents()
+        self.uevents = source
+        self.uevent_watch = GLib.io_add_watch(source.fileno(), GLib.PRIORITY_DEFAULT,
+                                              GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR, self.on_uevent)
+    
+    def on_uevent(self, fd, condition):
+        """Handle a batch of uevents with a single refresh"""
+        if condition & (GLib.IO_HUP | GLib.IO_ERR):
+            self.uevents.close()
+            self.uevents = None
+            return False
+        
+        try:
+            events = self.uevents.receive()
+        except OSError as e:
+            print(f"Power supply events failed, polling only: {e}")
+            self.uevents.close()
+            self.uevents = None
+            return False
+        if events:
+            if any(action in ("add", "remove") for action, properties in events):
+                self.refresh_supplies()
+            self.refresh_now()
         return True
     
+    def refresh_now(self):
+        """Have the sampling thread take a reading now and restart its interval"""
+        if self.paused:
+            return
+        self.sampling.wake()
+    
+    def pause(self):
+        """Stop sampling until resume()"""
+        if self.paused:
+            return
+        self.paused = True
+        self.sampling.paused = True
+        self.set_indicator_label("Paused", "", None)
+    
+    def resume(self):
+        if not self.paused:
+            return
+        self.paused = False
+        self.sampling.paused = False
+        self.sampling.wake()
+    
+    def start_capture(self, duration=None, rate=None):
+        """Hand a high-rate capture to the sampling thread.
+        
+        Defaults come from the capture config; raises ValueError if a
+        capture is running or the values are out of range. Whether the
+        battery can be read is checked on the sampling thread, as that
+        means a sysfs read.
+        """
+        if self.capture is not None:
+            raise ValueError("a capture is already running")
+        capture_config = self.config['capture']
+        capture = BurstCapture(capture_config['duration'] if duration is None else duration,
+                               capture_config['rate'] if rate is None else rate)
+        
+        self.capture = capture
+        self.sampling.capture(capture, self.save_capture)
+        self.set_indicator_label(f"Capturing {capture.duration:g} s", "", None)
+        self.update_capture_items()
+        return capture
+    
+    def save_capture(self, capture):
+        """Write the capture files (on the sampling thread) and report back"""
+        if capture.error is None:
+            try:
+                capture.save()
+            except OSError as e:
+                print(f"Error saving capture: {e}")
+        GLib.idle_add(self.capture_finished, capture)
+    
+    def capture_finished(self, capture):
+        self.capture = None
+        
+        # Redraw the label on the next reading
+        self.last_label = None
+        self.last_color = None
+        
+        if capture.error is not None:
+            self.update_capture_items()
+            self.alert("Cannot Capture Power", capture.error)
+            return False
+        
+        self.last_capture = capture
+        self.update_capture_items()
+        
+        message = capture.describe()
+        if capture.path is not None:
+            message += f"\nSaved to {capture.path}"
+        self.alert("Power Capture Finished", message)
+        return False
+    
+    def on_capture(self, widget):
+        try:
+            self.start_capture()
+        except ValueError as e:
+            self.alert("Cannot Capture Power", str(e))
+    
+    def start_control(self):
+        """Accept commands on the control socket"""
+        try:
+            self.control = ControlServer(CONTROL_SOCKET, self.handle_command)
+        except OSError as e:
+            print(f"Cannot open control socket {CONTROL_SOCKET}: {e}")
+    
+    def handle_command(self, command, argument):
+        """Run a control socket command and return the JSON reply"""
+        if command == "ping":
+            return {"ok": True, "pid": os.getpid()}
+        if command == "reload":
+            self.reload_config()
+            return {"ok": True}
+        if command == "snapshot":
+            return {"ok": True, "snapshot": self.snapshot_dict()}
+        if command == "pause":
+            self.pause()
+            return {"ok": True}
+        if command == "resume":
+            self.resume()
+            return {"ok": True}
+        if command == "capture":
+            try:
+                capture = self.start_capture(*[float(value) for value in argument.split()[:2]])
+            except ValueError as e:
+                return {"ok": False, "error": str(e)}
+            return {"ok": True, "duration": capture.duration, "rate": capture.rate,
+                    "samples": capture.count, "directory": str(CAPTURE_DIR)}
+        if command == "energy":
+            if self.energy is None:
+                return {"ok": False, "error": "energy accounting is disabled in the config"}
+            return {"ok": True, "energy": self.energy.report(history=True)}
+        if command == "diagnostics":
+            if self.instruments is None:
+                return {"ok": False, "error": "instrumentation is disabled in the config"}
+            return {"ok": True, "diagnostics": self.instruments.report()}
+        if command == "stats":
+            return {
+                "ok": True,
+                "paused": self.paused,
+                "interval": self.sampling.interval,
+                "samples": len(self.history),
+                "label_updates": self.label_updates
+            }
+        return {"ok": False, "error": f"unknown command {command!r}"}
+    
+    def watch_session_idle(self):
+        """Track screensaver activation to back off polling while idle"""
+        self.idle_watched = True
+        try:
+            bus = Gio.bus_get_sync(Gio.BusType.SESSION, None)
+        except Exception as e:
+            print(f"Session bus unavailable, idle detection disabled: {e}")
+            return
+        
+        for interface in ("org.mate.ScreenSaver", "org.freedesktop.ScreenSaver"):
+            bus.signal_subscribe(
+                None, interface, "ActiveChanged", None, None,
+                Gio.DBusSignalFlags.NONE, self.on_screensaver_changed
+            )
+    
+    def on_screensaver_changed(self, connection, sender, path, interface, signal, parameters):
+        """Mark the session idle while the screensaver is active"""
+        self.scheduler.idle = bool(parameters.unpack()[0])
+    
     def create_menu(self):
         """Create the context menu"""
         self.menu = Gtk.Menu()
+        self.menu_visible = False
+        self.next_menu_update = 0.0
         
         # Power info
         self.power_item = Gtk.MenuItem(label="Power: Calculating...")
@@ -243,7 +3583,8 @@ class BatteryPowerMonitor:
             self.current_item.set_sensitive(False)
             self.menu.append(self.current_item)
         
-        if self.config['show_battery_status'] or self.config['show_capacity']:
+        if (self.config['show_battery_status'] or self.config['show_capacity']
+                or self.config['show_time_estimate']):
             self.menu.append(Gtk.SeparatorMenuItem())
         
         # Battery status
@@ -258,6 +3599,106 @@ class BatteryPowerMonitor:
             self.capacity_item.set_sensitive(False)
             self.menu.append(self.capacity_item)
         
+        # Time to empty / full
+        if self.config['show_time_estimate']:
+            self.estimate_item = Gtk.MenuItem(label="Time Remaining: --")
+            self.estimate_item.set_sensitive(False)
+            self.menu.append(self.estimate_item)
+        
+        # Per-battery breakdown and AC adapter
+        self.pack_items = {}
+        self.ac_item = None
+        if self.config['show_batteries'] and isinstance(self.sampler, SupplyGroupSampler):
+            if len(self.sampler.batteries) > 1 or self.sampler.adapters:
+                self.menu.append(Gtk.SeparatorMenuItem())
+            if len(self.sampler.batteries) > 1:
+                for name in self.sampler.batteries:
+                    item = Gtk.MenuItem(label=f"{name}: --")
+                    item.set_sensitive(False)
+                    self.menu.append(item)
+                    self.pack_items[name] = item
+            if self.sampler.adapters:
+                self.ac_item = Gtk.MenuItem(label="AC Adapter: --")
+                self.ac_item.set_sensitive(False)
+                self.menu.append(self.ac_item)
+        
+        # Window statistics
+        if self.config['show_statistics']:
+            self.menu.append(Gtk.SeparatorMenuItem())
+            self.average_item = Gtk.MenuItem(label="Average 10s / 1m / 5m: --")
+            self.average_item.set_sensitive(False)
+            self.menu.append(self.average_item)
+            
+            self.range_item = Gtk.MenuItem(label="Min / Max (5 min): --")
+            self.range_item.set_sensitive(False)
+            self.menu.append(self.range_item)
+            
+            self.p95_item = Gtk.MenuItem(label="95th Percentile (5 min): --")
+            self.p95_item.set_sensitive(False)
+            self.menu.append(self.p95_item)
+        
+        # Processes using the most power
+        self.process_items = []
+        if self.attribution is not None:
+            self.menu.append(Gtk.SeparatorMenuItem())
+            heading = Gtk.MenuItem(label="Top Processes:")
+            heading.set_sensitive(False)
+            self.menu.append(heading)
+            for index in range(self.attribution.top_count):
+                item = Gtk.MenuItem(label="--")
+                item.set_sensitive(False)
+                self.menu.append(item)
+                self.process_items.append(item)
+        
+        # Energy used this session, today and in this discharge cycle
+        self.energy_items = {}
+        if self.energy is not None:
+            self.menu.append(Gtk.SeparatorMenuItem())
+            for period, title in (("session", "This Session"), ("day", "Today"),
+                                  ("cycle", "This Discharge")):
+                item = Gtk.MenuItem(label=f"{title}: --")
+                item.set_sensitive(False)
+                self.menu.append(item)
+                self.energy_items[period] = (item, title)
+        
+        # Power graphs, redrawn with the other menu items
+        self.graph_items = {}
+        self.graph_version = None
+        if self.graph is not None:
+            self.menu.append(Gtk.SeparatorMenuItem())
+            for span, title in PowerGraph.SPANS:
+                item = Gtk.ImageMenuItem(label=f"{title}: --")
+                item.set_always_show_image(True)
+                self.menu.append(item)
+                self.graph_items[span] = item
+        
+        # The monitor's own cost, when instrumentation is enabled
+        self.diagnostics_items = []
+        if self.instruments is not None:
+            diagnostics_menu = Gtk.Menu()
+            for index in range(5):
+                item = Gtk.MenuItem(label="--")
+                item.set_sensitive(False)
+                diagnostics_menu.append(item)
+                self.diagnostics_items.append(item)
+            diagnostics_item = Gtk.MenuItem(label="Diagnostics")
+            diagnostics_item.set_submenu(diagnostics_menu)
+            self.menu.append(Gtk.SeparatorMenuItem())
+            self.menu.append(diagnostics_item)
+        
+        # High-rate capture of a short event
+        capture_config = self.config['capture']
+        self.capture_item = Gtk.MenuItem(
+            label=f"Capture {capture_config['duration']:g} s at {capture_config['rate']:g} Hz"
+        )
+        self.capture_item.connect("activate", self.on_capture)
+        self.capture_result_item = Gtk.MenuItem(label="Last Capture: --")
+        self.capture_result_item.set_sensitive(False)
+        self.menu.append(Gtk.SeparatorMenuItem())
+        self.menu.append(self.capture_item)
+        self.menu.append(self.capture_result_item)
+        self.update_capture_items()
+        
         # Separator
         self.menu.append(Gtk.SeparatorMenuItem())
         
@@ -272,39 +3713,188 @@ class BatteryPowerMonitor:
         self.menu.append(quit_item)
         
         self.menu.show_all()
+        self.menu.connect("show", self.on_menu_show)
+        self.menu.connect("hide", self.on_menu_hide)
         self.indicator.set_menu(self.menu)
     
-    def update_menu_items(self):
-        """Update menu items with current values"""
-        power = self.get_power_draw()
+    def update_capture_items(self):
+        """Disable the capture item while one runs and show the last result"""
+        self.capture_item.set_sensitive(self.capture is None)
+        if self.last_capture is not None:
+            self.capture_result_item.set_label(f"Last Capture: {self.last_capture.describe()}")
+    
+    def on_menu_show(self, menu):
+        """Render the menu from the latest snapshot when it opens"""
+        self.menu_visible = True
+        if self.snapshot is not None:
+            self.update_menu_items(self.snapshot)
+    
+    def on_menu_hide(self, menu):
+        """Go back to refreshing only the text every MENU_REFRESH_INTERVAL"""
+        self.menu_visible = False
+    
+    def update_menu_items(self, snapshot, full=True):
+        """Update menu items with the values of a snapshot.
+        
+        Unless full, only the text labels are set: the process list, graphs
+        and diagnostics cost a scan, pixbufs or /proc reads, and are left
+        for when the menu is open.
+        """
+        power = snapshot.watts
         
         if power is not None:
             decimals = self.config['decimal_places']
             self.power_item.set_label(f"Power Draw: {power:.{decimals}f} W")
         
         if self.config['show_voltage']:
-            voltage = self.read_battery_value("voltage_now")
+            voltage = snapshot.voltage
             if voltage:
                 self.voltage_item.set_label(f"Voltage: {voltage/1_000_000:.2f} V")
         
         if self.config['show_current']:
-            current = self.read_battery_value("current_now")
+            current = snapshot.current
             if current:
                 self.current_item.set_label(f"Current: {current/1_000_000:.2f} A")
         
         if self.config['show_battery_status']:
-            status = self.read_battery_string("status")
+            status = snapshot.status
             if status:
                 self.status_item.set_label(f"Status: {status}")
         
         if self.config['show_capacity']:
-            capacity = self.read_battery_value("capacity")
+            capacity = snapshot.capacity
             if capacity is not None:
                 self.capacity_item.set_label(f"Capacity: {capacity}%")
+        
+        for name, pack in snapshot.packs:
+            item = self.pack_items.get(name)
+            if item is not None and pack.power is not None:
+                label = f"{name}: {pack.watts:.{self.config['decimal_places']}f} W"
+                if pack.capacity is not None:
+                    label += f", {pack.capacity}%"
+                if pack.status:
+                    label += f" ({pack.status})"
+                item.set_label(label)
+        
+        if self.ac_item is not None and snapshot.ac_online is not None:
+            self.ac_item.set_label(f"AC Adapter: {'Online' if snapshot.ac_online else 'Offline'}")
+        
+        if self.config['show_time_estimate']:
+            self.update_estimate_item()
+        
+        if self.config['show_statistics']:
+            self.update_statistics_items()
+        
+        if self.energy_items:
+            self.update_energy_items()
+        
+        if not full:
+            return
+        
+        if self.process_items:
+            self.update_process_items()
+        
+        if self.graph_items:
+            self.update_graph_items()
+        
+        if self.diagnostics_items:
+            self.update_diagnostics_items()
+    
+    def update_estimate_item(self):
+        """Update the time to empty / full menu item"""
+        if self.estimate is None:
+            self.estimate_item.set_label("Time Remaining: --")
+            return
+        
+        mode, seconds, low, high = self.estimate
+        title = "Time Remaining" if mode == "empty" else "Time to Full"
+        self.estimate_item.set_label(
+            f"{title}: {format_duration(seconds)} ({format_duration(low)} – {format_duration(high)})"
+        )
+    
+    def update_statistics_items(self):
+        """Update the window statistics menu items"""
+        decimals = self.config['decimal_places']
+        averages = [self.stats.ema[seconds] for seconds in RollingStats.WINDOWS]
+        if averages[0] is not None:
+            text = " / ".join(f"{value:.{decimals}f}" for value in averages)
+            self.average_item.set_label(f"Average 10s / 1m / 5m: {text} W")
+        
+        window = self.stats.windows[300]
+        if window.size:
+            self.range_item.set_label(
+                f"Min / Max (5 min): {window.minimum():.{decimals}f} / {window.maximum():.{decimals}f} W"
+            )
+            self.p95_item.set_label(f"95th Percentile (5 min): {window.percentile(0.95):.1f} W")
+    
+    def update_process_items(self):
+        """Update the top processes menu items"""
+        top = self.attribution.top
+        for index, item in enumerate(self.process_items):
+            if index >= len(top):
+                item.set_label("--")
+                continue
+            name, pid, cpu, watts = top[index]
+            if watts is not None:
+                item.set_label(f"{name} ({pid}): {watts:.1f} W, {cpu:.0f}% CPU")
+            else:
+                item.set_label(f"{name} ({pid}): {cpu:.0f}% CPU")
+    
+    def update_energy_items(self):
+        """Update the energy totals menu items"""
+        totals = self.energy.report()
+        for period, (item, title) in self.energy_items.items():
+            total = totals[period]
+            if total is None:
+                item.set_label(f"{title}: --")
+                continue
+            label = f"{title}: {total['discharged_wh']:.1f} Wh"
+            if total['charged_wh'] >= 0.05:
+                label += f", {total['charged_wh']:.1f} Wh charged"
+            if period == "cycle":
+                label += f" in {format_duration(total['end'] - total['start'])}"
+            item.set_label(label)
+    
+    def update_graph_items(self):
+        """Redraw the graphs if a sample arrived since they were last drawn"""
+        if self.graph.version == self.graph_version:
+            return
+        self.graph_version = self.graph.version
+        
+        now = time.time()
+        width, height = self.GRAPH_SIZE
+        titles = dict(PowerGraph.SPANS)
+        for span, item in self.graph_items.items():
+            columns = self.graph.series[span].columns(now)
+            pixels = render_sparkline(columns, width, height, self.config['color_coding'])
+            pixbuf = GdkPixbuf.Pixbuf.new_from_bytes(GLib.Bytes.new(pixels), GdkPixbuf.Colorspace.RGB,
+                                                     True, 8, width, height, width * 4)
+            item.set_image(Gtk.Image.new_from_pixbuf(pixbuf))
+            
+            lows = [low for low, high in columns if not math.isnan(low)]
+            highs = [high for low, high in columns if not math.isnan(high)]
+            if highs:
+                item.set_label(f"{titles[span]}: {min(lows):.1f} – {max(highs):.1f} W")
+    
+    def update_diagnostics_items(self):
+        """Update the Diagnostics submenu from the tick instruments"""
+        report = self.instruments.report()
+        lines = ["Tick p50 / p99: --", "Sysfs reads per tick: --"]
+        if "tick_wall_us" in report:
+            wall = report['tick_wall_us']
+            lines = [f"Tick p50 / p99: {wall['p50'] / 1000:.2f} / {wall['p99'] / 1000:.2f} ms",
+                     f"Sysfs reads per tick: {report['sysfs_reads_per_tick']:.1f}"]
+        lines += [
+            f"Monitor CPU: {report['cpu_percent']:.2f}% ({report['tick_cpu_percent']:.2f}% in ticks)",
+            f"Wakeups: {report['wakeups_per_min']:.0f}/min ({report['ticks_per_min']:.0f} ticks)",
+            f"Memory: {report['rss_bytes'] / (1 << 20):.1f} MB",
+        ]
+        for item, line in zip(self.diagnostics_items, lines):
+            item.set_label(line)
     
     def open_settings(self, widget):
         """Open configuration file in default editor"""
-        config_file = Path.home() / ".config" / "battery-power-monitor.json"
+        config_file = CONFIG_FILE
         
         try:
             import subprocess
@@ -319,25 +3909,202 @@ class BatteryPowerMonitor:
             dialog.run()
             dialog.destroy()
     
+    def on_signal(self):
+        """Quit on SIGHUP, SIGINT or SIGTERM"""
+        self.quit(None)
+        return False
+    
     def quit(self, widget):
         """Quit the application"""
+        self.sampling.stop()
+        self.close()
+        self.stop_uevents()
+        if self.control is not None:
+            self.control.close()
         Gtk.main_quit()
 
+def dump_log(hours):
+    """Print the last hours of the power log as CSV"""
+    start = time.time() - hours * 3600 if hours else 0
+    print("timestamp,voltage_uv,current_ua,power_w,status")
+    for timestamp, voltage, current, status in PowerLogReader().read(start):
+        print(f"{timestamp:.3f},{voltage},{current},{voltage * current / 1e12:.3f},{status}")
+
+def dump_energy():
+    """Print the finished and current days and discharge cycles as CSV"""
+    energy = EnergyAccount()
+    print("period,date,start,end,discharged_wh,charged_wh,start_capacity,end_capacity")
+    rows = [("day", day) for day in (*energy.days, energy.day) if day is not None]
+    rows += [("cycle", cycle) for cycle in (*energy.cycles, energy.cycle) if cycle is not None]
+    for period, total in rows:
+        capacities = (total.get("start_capacity"), total.get("end_capacity"))
+        print(f"{period},{total.get('date', '')},{total['start']:.0f},{total['end']:.0f},"
+              f"{total['discharged_wh']:.3f},{total['charged_wh']:.3f},"
+              + ",".join("" if value is None else str(value) for value in capacities))
+
+def run_capture(duration, rate):
+    """Capture through the running monitor, or directly if none is running"""
+    argument = f"{duration:g}" if rate is None else f"{duration:g} {rate:g}"
+    reply = send_command(f"capture {argument}")
+    if reply is not None:
+        print(json.dumps(reply, indent=2))
+        return 0 if reply.get("ok") else 1
+    
+    # Only a sampler: a headless daemon has no control socket, and this
+    # must not write its energy totals or power log next to it
+    config = MonitorCore.load_config()
+    sampler = open_sampler(config['battery_device'], discover_power_supplies())
+    try:
+        capture = BurstCapture(duration, config['capture']['rate'] if rate is None else rate)
+        # The first reading chooses the power source
+        sampler.sample()
+        capture.check(sampler.read_power)
+        print(f"Capturing {capture.duration:g} s at {capture.rate:g} Hz...")
+        try:
+            capture.run(sampler.read_power)
+        except KeyboardInterrupt:
+            pass
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    finally:
+        sampler.close()
+    
+    print(capture.describe())
+    print(f"Saved to {capture.save()}")
+    return 0
+
+class StartupProfile:
+    """Wall clock and CPU time of each startup phase, for --profile-startup"""
+    
+    def __init__(self):
+        # Interpreter start-up and loading this file happened before main(),
+        # so that phase is measured from the process start time in /proc
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        cpu = time.process_time()
+        self.phases = [("interpreter and module load", uptime - start_ticks / os.sysconf("SC_CLK_TCK"), cpu)]
+        self.last_wall = time.perf_counter()
+        self.last_cpu = cpu
+    
+    def mark(self, phase):
+        """End the current phase and start the next one"""
+        wall, cpu = time.perf_counter(), time.process_time()
+        self.phases.append((phase, wall - self.last_wall, cpu - self.last_cpu))
+        self.last_wall, self.last_cpu = wall, cpu
+    
+    def report(self):
+        print(f"{'phase':<46} {'wall ms':>8} {'cpu ms':>8}")
+        total_wall = total_cpu = 0
+        for phase, wall, cpu in self.phases:
+            total_wall += wall
+            total_cpu += cpu
+            print(f"{phase:<46} {wall * 1000:8.1f} {cpu * 1000:8.1f}")
+        print(f"{'total':<46} {total_wall * 1000:8.1f} {total_cpu * 1000:8.1f}")
+
 def main():
-    # Check if battery device exists
-    battery_device = CONFIG['battery_device']
-    battery_path = f"/sys/class/power_supply/{battery_device}"
+    global POWER_SUPPLY_ROOT
+    import argparse
+    parser = argparse.ArgumentParser(description="Battery power monitor for the system tray")
+    parser.add_argument("--dump-log", type=float, metavar="HOURS", nargs="?", const=0,
+                        help="print the binary power log as CSV (last HOURS, default all) and exit")
+    parser.add_argument("--dump-energy", action="store_true",
+                        help="print the saved energy totals per day and discharge cycle as CSV and exit")
+    parser.add_argument("--command", metavar="COMMAND",
+                        help="send ping, reload, snapshot, stats, energy, diagnostics, pause, resume or "
+                             "capture [SECONDS [HZ]] to the running monitor and print its reply")
+    parser.add_argument("--capture", type=float, metavar="SECONDS",
+                        help="sample power at a high rate for SECONDS and save the trace "
+                             "(through the running monitor if there is one)")
+    parser.add_argument("--rate", type=float, metavar="HZ",
+                        help="samples per second for --capture (default from the config file)")
+    parser.add_argument("--headless", action="store_true",
+                        help="run without the tray icon and serve metrics over HTTP")
+    parser.add_argument("--port", type=int,
+                        help="port for --headless, 0 for any free one (default from the config file)")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="print how long each startup phase takes and exit")
+    parser.add_argument("--sysfs-root", metavar="PATH",
+                        help=f"read power supplies from PATH instead of {POWER_SUPPLY_ROOT}")
+    args = parser.parse_args()
+    if args.sysfs_root:
+        POWER_SUPPLY_ROOT = args.sysfs_root
+    profile = None
+    if args.profile_startup:
+        profile = StartupProfile()
+        profile.mark("argument parsing")
+    
+    if args.dump_log is not None:
+        dump_log(args.dump_log)
+        return 0
     
-    if not os.path.exists(battery_path):
-        print(f"Error: Battery device {battery_device} not found!")
+    if args.dump_energy:
+        dump_energy()
+        return 0
+    
+    if args.capture is not None:
+        return run_capture(args.capture, args.rate)
+    
+    if args.command:
+        reply = send_command(args.command)
+        if reply is None:
+            print("Battery power monitor is not running")
+            return 1
+        print(json.dumps(reply, indent=2))
+        return 0 if reply.get("ok") else 1
+    
+    if not args.headless:
+        if not load_gtk():
+            print("Error: GTK and AppIndicator3 bindings are not available!")
+            print("Install with: sudo apt install python3-gi gir1.2-appindicator3-0.1")
+            return 1
+        if profile is not None:
+            profile.mark("GTK and AppIndicator3 imports")
+    
+    # Check that there is a battery to monitor
+    supplies = discover_power_supplies()
+    if "Battery" not in supplies.values():
+        print("Error: No battery found!")
         print("\nAvailable devices:")
-        power_supply = Path("/sys/class/power_supply")
-        if power_supply.exists():
-            for device in power_supply.iterdir():
-                print(f"  - {device.name}")
+        for name, kind in supplies.items():
+            print(f"  - {name} ({kind})")
         return 1
     
-    monitor = BatteryPowerMonitor()
+    if args.headless:
+        try:
+            monitor = HeadlessMonitor(port=args.port, profile=profile)
+        except OSError as e:
+            print(f"Error: cannot start the metrics server: {e}")
+            return 1
+        if profile is not None:
+            monitor.update()
+            profile.mark("first reading")
+            profile.report()
+            monitor.close()
+            return 0
+        address, port = monitor.server.sock.getsockname()[:2]
+        print(f"Serving battery metrics on http://{address}:{port}/metrics")
+        monitor.run()
+        return 0
+    
+    # Only one monitor per session; a second launch asks the first to reload.
+    # A profiling run opens no control socket, so it can run alongside.
+    if profile is None:
+        try:
+            lock = acquire_instance_lock()
+        except OSError as e:
+            print(f"Error: {e}")
+            return 1
+        if lock is None:
+            if send_command("reload") is not None:
+                print("Battery power monitor is already running, asked it to reload its config")
+            else:
+                print("Battery power monitor is already running")
+            return 0
+    
+    monitor = BatteryPowerMonitor(profile)
     Gtk.main()
     return 0
 
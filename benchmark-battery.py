@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Benchmark the per-tick path of the battery power monitor against fake
+power supply trees and print the results as JSON
+"""
+
+import argparse
+import gc
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from script_loader import load_script
+
+# Scenario name -> (battery kind, number of batteries)
+SCENARIOS = {
+    "power_now": ("power_now", 1),
+    "full": ("full", 1),
+    "voltage_current": ("voltage_current", 1),
+    "energy_counter": ("energy", 1),
+    "two_batteries": ("full", 2),
+}
+
+# Every alert rule enabled, so the alert path does its full work each tick
+BENCHMARK_CONFIG = {
+    "notify_high_power": {"enabled": True, "threshold": 1.0, "cooldown": 0},
+    "alert_rules": [
+        {"name": "Sustained", "metric": "power", "condition": ">", "value": 1.0,
+         "duration": 5, "cooldown": 0},
+        {"name": "Low", "metric": "capacity", "condition": "<", "value": 90,
+         "duration": 0, "status": "Discharging", "cooldown": 0},
+        {"name": "Average", "metric": "power_avg", "condition": ">", "value": 1.0,
+         "duration": 0, "cooldown": 0},
+    ],
+}
+
+def read_syscalls():
+    """(read, write) syscalls made by this process so far, or None"""
+    try:
+        with open("/proc/self/io") as f:
+            counters = dict(line.split(": ") for line in f.read().splitlines())
+    except OSError:
+        return None
+    return int(counters["syscr"]), int(counters["syscw"])
+
+def syscall_overhead():
+    """Syscalls made by read_syscalls() itself"""
+    before = read_syscalls()
+    after = read_syscalls()
+    return after[0] - before[0], after[1] - before[1]
+
+def percentile(ordered, fraction):
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+def measure(step, ticks, between=None):
+    """Latency, syscalls and allocations of step(), called once per tick.
+
+    between() runs after each timed call (to change the fake readings)
+    and is left out of the latency. Syscalls and allocations are counted
+    in separate passes without it, as writing the fixture would show up
+    in both.
+    """
+    gc.collect()
+    gc.disable()
+    try:
+        latencies = []
+        for tick in range(ticks):
+            start = time.perf_counter_ns()
+            step()
+            latencies.append(time.perf_counter_ns() - start)
+            if between is not None:
+                between()
+        latencies.sort()
+        
+        before = read_syscalls()
+        for tick in range(ticks):
+            step()
+        after = read_syscalls()
+        
+        # Collecting also empties the interpreter's free lists, so only
+        # blocks that are still referenced count as retained
+        gc.collect()
+        blocks = sys.getallocatedblocks()
+        for tick in range(ticks):
+            step()
+        gc.collect()
+        retained = sys.getallocatedblocks() - blocks
+        
+        tracemalloc.start()
+        peak = 0
+        for tick in range(ticks):
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            step()
+            peak += tracemalloc.get_traced_memory()[1] - current
+        tracemalloc.stop()
+    finally:
+        gc.enable()
+    
+    result = {
+        "mean_us": sum(latencies) / len(latencies) / 1000,
+        "p50_us": percentile(latencies, 0.50) / 1000,
+        "p99_us": percentile(latencies, 0.99) / 1000,
+        "max_us": latencies[-1] / 1000,
+        "read_syscalls": None,
+        "write_syscalls": None,
+        "retained_blocks": retained / ticks,
+        "peak_alloc_bytes": peak / ticks,
+    }
+    if before is not None:
+        overhead = syscall_overhead()
+        result["read_syscalls"] = (after[0] - before[0] - overhead[0]) / ticks
+        result["write_syscalls"] = (after[1] - before[1] - overhead[1]) / ticks
+    return result
+
+def run_scenario(monitor, fake, directory, kind, count, ticks):
+    tree = fake.FakePowerSupplyTree(Path(directory) / "power_supply")
+    names = [f"BAT{index}" for index in range(count)]
+    for name in names:
+        tree.add_battery(name, kind)
+    tree.add_adapter("AC")
+    monitor.POWER_SUPPLY_ROOT = str(tree.root)
+    
+    core = monitor.MonitorCore()
+    core.alert = lambda title, message: None
+    watts = [10.0]
+    
+    def change_readings():
+        watts[0] = 20.0 - watts[0]
+        for name in names:
+            tree.advance(name, 1)
+            tree.set_power(name, watts[0])
+    
+    # Counter sources need a couple of counter changes before they report power
+    for tick in range(3):
+        change_readings()
+        core.take_sample()
+    
+    snapshot = core.snapshot
+    
+    def format_label():
+        core.format_power_label(snapshot)
+        core.get_power_color(snapshot)
+    
+    sources = [sampler.source for sampler in getattr(core.sampler, "batteries", {}).values()]
+    results = {
+        "source": getattr(core.sampler, "source", None) or ",".join(sorted(set(sources))),
+        # Reading sysfs only
+        "sample": measure(core.sampler.sample, ticks, change_readings),
+        # Reading plus history, statistics and time estimate
+        "tick": measure(core.take_sample, ticks, change_readings),
+        # Panel label text and colour
+        "format": measure(format_label, ticks),
+        # Evaluating every alert rule (the notification itself is D-Bus and not timed)
+        "alerts": measure(lambda: core.check_alerts(snapshot), ticks),
+        # Headless /metrics page
+        "metrics": measure(core.metrics_text, ticks),
+    }
+    core.close()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--ticks", type=int, default=2000, help="ticks per measurement (default 2000)")
+    parser.add_argument("--scenario", choices=SCENARIOS, action="append",
+                        help="run only this scenario (repeatable)")
+    parser.add_argument("--output", metavar="FILE", help="write the JSON here instead of stdout")
+    args = parser.parse_args()
+    
+    monitor = load_script("battery-power-monitor.py", "battery-power-monitor")
+    fake = load_script("fake-battery.py")
+    
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "ticks": args.ticks,
+        "scenarios": {},
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        # Defaults plus BENCHMARK_CONFIG, never the user's config or energy totals
+        monitor.CONFIG_FILE = Path(directory) / "config.json"
+        monitor.ENERGY_FILE = Path(directory) / "energy.json"
+        with open(monitor.CONFIG_FILE, "w") as f:
+            json.dump(BENCHMARK_CONFIG, f)
+        
+        for name in args.scenario or SCENARIOS:
+            kind, count = SCENARIOS[name]
+            with tempfile.TemporaryDirectory(dir=directory) as scenario_directory:
+                report["scenarios"][name] = run_scenario(monitor, fake, scenario_directory,
+                                                         kind, count, args.ticks)
+    
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
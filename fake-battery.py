@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Fake /sys/class/power_supply tree for running and testing the monitor
+without a battery (or without the battery you want to test against)
+"""
+
+import argparse
+import csv
+import os
+import random
+import shutil
+import time
+from pathlib import Path
+
+# Attributes each kind of battery exposes besides type and present.
+# "power_now" is a device that only reports power, "energy"
+# and "charge" only have counters the monitor has to differentiate.
+BATTERY_KINDS = {
+    "full": ("status", "capacity", "power_now", "voltage_now", "current_now",
+             "energy_now", "energy_full"),
+    "power_now": ("status", "capacity", "power_now"),
+    "voltage_current": ("status", "capacity", "voltage_now", "current_now",
+                        "charge_now", "charge_full"),
+    "energy": ("status", "capacity", "voltage_now", "energy_now", "energy_full"),
+    "charge": ("status", "capacity", "voltage_now", "charge_now", "charge_full"),
+}
+
+class FakePowerSupplyTree:
+    """A directory laid out like /sys/class/power_supply.
+
+    Values are rewritten in place, so (as in sysfs) an attribute keeps its
+    inode and the monitor's persistent file descriptors see every update.
+    Energy and charge counters only move when advance() is called.
+    
+    Removing a supply empties its attribute files before deleting them,
+    because a descriptor the monitor already holds would otherwise go on
+    reading the unlinked file. The monitor treats an empty read like the
+    ENODEV a removed sysfs attribute returns and reopens the path. With
+    uevents (a FakeUeventSource the monitor is listening to), adding,
+    removing and changing a supply also sends the kernel's event, so the
+    monitor rediscovers the supplies as it does on real hotplug.
+    """
+    
+    def __init__(self, root, uevents=None):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.batteries = {}
+        self.uevents = uevents
+    
+    def emit(self, action, name):
+        if self.uevents is not None:
+            self.uevents.emit(action, name)
+    
+    def write(self, name, attribute, value):
+        """Set one attribute, creating it if needed"""
+        path = self.root / name / attribute
+        with open(path, "w") as f:
+            f.write(f"{value}\n")
+    
+    def add_battery(self, name="BAT0", kind="full", watts=10.0, volts=12.0, capacity=80,
+                    status="Discharging", full_wh=50.0):
+        """Create (or replace) a battery exposing the attributes of kind"""
+        if kind not in BATTERY_KINDS:
+            raise ValueError(f"unknown battery kind {kind!r}, expected one of {', '.join(BATTERY_KINDS)}")
+        
+        self.remove(name)
+        (self.root / name).mkdir()
+        self.write(name, "type", "Battery")
+        self.write(name, "present", 1)
+        self.batteries[name] = {
+            "kind": kind,
+            "attributes": set(BATTERY_KINDS[kind]),
+            "watts": watts,
+            "volts": volts,
+            "status": status,
+            "full_wh": full_wh,
+            "energy_wh": full_wh * capacity / 100,
+        }
+        self.update(name)
+        self.emit("add", name)
+    
+    def add_adapter(self, name="AC", online=False):
+        (self.root / name).mkdir(exist_ok=True)
+        self.write(name, "type", "Mains")
+        self.write(name, "online", int(online))
+        self.emit("change", name)
+    
+    def add_peripheral(self, name="hid-mouse-battery", capacity=60):
+        """A device battery (scope Device) that must not count as a system battery"""
+        (self.root / name).mkdir(exist_ok=True)
+        self.write(name, "type", "Battery")
+        self.write(name, "scope", "Device")
+        self.write(name, "capacity", capacity)
+    
+    def set_power(self, name, watts, volts=None, status=None):
+        battery = self.batteries[name]
+        battery["watts"] = watts
+        if volts is not None:
+            battery["volts"] = volts
+        if status is not None:
+            battery["status"] = status
+        self.update(name)
+        self.emit("change", name)
+    
+    def advance(self, name, seconds):
+        """Move the energy counter by seconds of the current power"""
+        battery = self.batteries[name]
+        delta = battery["watts"] * seconds / 3600
+        if battery["status"] == "Charging":
+            battery["energy_wh"] = min(battery["energy_wh"] + delta, battery["full_wh"])
+        else:
+            battery["energy_wh"] = max(battery["energy_wh"] - delta, 0.0)
+        self.update(name)
+    
+    def update(self, name):
+        """Write the battery state to whichever attributes it exposes"""
+        battery = self.batteries[name]
+        volts = battery["volts"]
+        values = {
+            "power_now": round(battery["watts"] * 1e6),
+            "voltage_now": round(volts * 1e6),
+            "current_now": round(battery["watts"] / volts * 1e6),
+            "energy_now": round(battery["energy_wh"] * 1e6),
+            "energy_full": round(battery["full_wh"] * 1e6),
+            "charge_now": round(battery["energy_wh"] / volts * 1e6),
+            "charge_full": round(battery["full_wh"] / volts * 1e6),
+            "status": battery["status"],
+            "capacity": round(100 * battery["energy_wh"] / battery["full_wh"]),
+        }
+        for attribute in battery["attributes"]:
+            self.write(name, attribute, values[attribute])
+    
+    def remove_attribute(self, name, attribute):
+        """Simulate a driver that does not provide attribute"""
+        self.batteries[name]["attributes"].discard(attribute)
+        try:
+            os.unlink(self.root / name / attribute)
+        except FileNotFoundError:
+            pass
+    
+    def remove(self, name):
+        """Hot-unplug a supply"""
+        directory = self.root / name
+        if not directory.exists():
+            return
+        self.batteries.pop(name, None)
+        for path in directory.iterdir():
+            if path.is_file():
+                open(path, "w").close()
+        shutil.rmtree(directory, ignore_errors=True)
+        self.emit("remove", name)
+    
+    def replay(self, name, rows, speed=1.0, sleep=time.sleep):
+        """Play back (timestamp, voltage µV, current µA, power W, status) rows.
+
+        Rows are the CSV printed by battery-power-monitor --dump-log; the
+        gaps between timestamps are kept, divided by speed.
+        """
+        last_timestamp = None
+        for timestamp, voltage, current, watts, status in rows:
+            if last_timestamp is not None:
+                gap = max(timestamp - last_timestamp, 0)
+                self.advance(name, gap)
+                sleep(gap / speed)
+            last_timestamp = timestamp
+            self.set_power(name, watts, volts=voltage / 1e6 if voltage else None, status=status)
+
+def read_trace(path):
+    """Rows of a --dump-log CSV file as numbers"""
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            yield (float(row["timestamp"]), int(row["voltage_uv"]), int(row["current_ua"]),
+                   float(row["power_w"]), row["status"])
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Create a fake power supply tree; run the monitor on it with "
+                    "BATTERY_POWER_SUPPLY_ROOT=DIR or --sysfs-root DIR")
+    parser.add_argument("root", metavar="DIR", help="directory for the tree")
+    parser.add_argument("--kind", choices=BATTERY_KINDS, default="full",
+                        help="attributes the batteries expose (default: full)")
+    parser.add_argument("--batteries", type=int, default=1, help="number of batteries (BAT0, BAT1, ...)")
+    parser.add_argument("--watts", type=float, default=10.0, help="power draw per battery")
+    parser.add_argument("--ac", action="store_true", help="add an AC adapter that is online")
+    parser.add_argument("--peripheral", action="store_true", help="add a wireless mouse battery")
+    parser.add_argument("--missing", metavar="ATTRIBUTE", action="append", default=[],
+                        help="leave ATTRIBUTE out of every battery (repeatable)")
+    parser.add_argument("--replay", metavar="CSV", help="play a --dump-log trace into BAT0")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed factor")
+    parser.add_argument("--simulate", action="store_true",
+                        help="keep changing power and counters every second until interrupted")
+    parser.add_argument("--hotplug", type=float, metavar="SECONDS",
+                        help="with --simulate, unplug and replug the last battery every SECONDS "
+                             "(no uevents reach the monitor from here, so it only reopens the files)")
+    args = parser.parse_args()
+    
+    tree = FakePowerSupplyTree(args.root)
+    names = [f"BAT{index}" for index in range(args.batteries)]
+    status = "Charging" if args.ac else "Discharging"
+    
+    def plug(name):
+        tree.add_battery(name, args.kind, watts=args.watts, status=status)
+        for attribute in args.missing:
+            tree.remove_attribute(name, attribute)
+    
+    for name in names:
+        plug(name)
+    tree.add_adapter("AC", online=args.ac)
+    if args.peripheral:
+        tree.add_peripheral()
+    print(f"Fake power supplies in {tree.root}: {', '.join(sorted(os.listdir(tree.root)))}")
+    print(f"Run: battery-power-monitor --sysfs-root {tree.root}")
+    
+    try:
+        if args.replay:
+            tree.replay(names[0], read_trace(args.replay), args.speed)
+        elif args.simulate:
+            plugged = True
+            last_hotplug = time.monotonic()
+            while True:
+                time.sleep(1)
+                for name in tree.batteries:
+                    battery = tree.batteries[name]
+                    tree.advance(name, 1)
+                    tree.set_power(name, max(0.5, battery["watts"] + random.uniform(-1, 1)))
+                
+                if args.hotplug and time.monotonic() - last_hotplug >= args.hotplug:
+                    last_hotplug = time.monotonic()
+                    if plugged:
+                        tree.remove(names[-1])
+                    else:
+                        plug(names[-1])
+                    plugged = not plugged
+                    print(f"{names[-1]} {'plugged in' if plugged else 'unplugged'}")
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
@@ -19,7 +19,8 @@ fi
 echo "🔍 Detecting battery device..."
 BATTERY_DEVICE=""
 for dev in /sys/class/power_supply/*; do
-    if [ -f "$dev/voltage_now" ] && [ -f "$dev/current_now" ]; then
+    if [ -f "$dev/power_now" ] || [ -f "$dev/energy_now" ] || [ -f "$dev/charge_now" ] || \
+       { [ -f "$dev/voltage_now" ] && [ -f "$dev/current_now" ]; }; then
         BATTERY_DEVICE=$(basename "$dev")
         echo "✅ Found battery: $BATTERY_DEVICE"
         break
@@ -66,7 +67,7 @@ if [ ! -f "$CONFIG_FILE" ]; then
     cat > "$CONFIG_FILE" << EOF
 {
     "update_interval": 1,
-    "battery_device": "$BATTERY_DEVICE",
+    "battery_device": "auto",
     "display_format": "short",
     "decimal_places": 2,
     "color_coding": {
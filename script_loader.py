@@ -0,0 +1,19 @@
+"""
+Load the sibling scripts, whose hyphenated file names cannot be imported
+"""
+
+import importlib.util
+from importlib.machinery import SourceFileLoader
+from pathlib import Path
+
+def load_script(file_name, installed=None):
+    """Load a script next to this file, or the installed copy in ~/.local/bin"""
+    path = Path(__file__).with_name(file_name)
+    if not path.exists() and installed:
+        path = Path.home() / ".local" / "bin" / installed
+    
+    loader = SourceFileLoader(file_name.replace("-", "_")[:-3], str(path))
+    spec = importlib.util.spec_from_loader(loader.name, loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module
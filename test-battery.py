@@ -4,33 +4,43 @@ Quick test script to verify battery power monitoring works
 """
 
 import os
+import time
 from pathlib import Path
 
+from script_loader import load_script
+
 print("🔍 Battery Power Monitor - System Check")
 print("=" * 50)
 
 # Check for battery devices
 print("\n1. Checking for battery devices...")
-power_supply = Path("/sys/class/power_supply")
+try:
+    monitor = load_script("battery-power-monitor.py", "battery-power-monitor")
+except Exception as e:
+    print(f"   ❌ Could not load battery-power-monitor.py: {e}")
+    exit(1)
+
+# BATTERY_POWER_SUPPLY_ROOT points this at a fake tree (see fake-battery.py)
+power_supply = Path(monitor.POWER_SUPPLY_ROOT)
 
 if not power_supply.exists():
     print("   ❌ No power supply directory found!")
     exit(1)
 
+supplies = monitor.discover_power_supplies(str(power_supply))
 batteries = []
-for device in power_supply.iterdir():
-    voltage_file = device / "voltage_now"
-    current_file = device / "current_now"
-    
-    if voltage_file.exists() and current_file.exists():
-        batteries.append(device.name)
-        print(f"   ✅ Found battery: {device.name}")
+for name, kind in supplies.items():
+    if kind == "Battery":
+        batteries.append(name)
+        print(f"   ✅ Found battery: {name}")
+    elif kind in ("Mains", "USB"):
+        print(f"   ℹ️  Found AC adapter: {name}")
 
 if not batteries:
     print("   ❌ No compatible batteries found!")
     print("   Available devices:")
-    for device in power_supply.iterdir():
-        print(f"      - {device.name}")
+    for name, kind in supplies.items():
+        print(f"      - {name} ({kind})")
     exit(1)
 
 # Test reading power from first battery
@@ -40,33 +50,48 @@ battery_path = power_supply / battery
 print(f"\n2. Testing power reading from {battery}...")
 
 try:
-    with open(battery_path / "voltage_now") as f:
-        voltage = int(f.read().strip())
-    with open(battery_path / "current_now") as f:
-        current = int(f.read().strip())
+    sampler = monitor.BatterySampler(str(battery_path))
+    snapshot = sampler.sample()
+    
+    if sampler.source is None:
+        raise RuntimeError("no power_now, voltage_now/current_now, energy_now or charge_now")
+    print(f"   ✅ Power source: {sampler.source}")
     
-    power = (voltage * current) / 1_000_000_000_000
+    if sampler.source in ("energy_delta", "charge_delta"):
+        # Power is derived from counter changes, which take a while
+        print("   ⏳ Waiting for the battery counter to change (up to 60 s)...")
+        deadline = time.monotonic() + 60
+        while snapshot.power is None and time.monotonic() < deadline:
+            time.sleep(1)
+            snapshot = sampler.sample()
     
-    print(f"   ✅ Voltage: {voltage/1_000_000:.2f} V")
-    print(f"   ✅ Current: {current/1_000_000:.2f} A")
-    print(f"   ✅ Power: {power:.2f} W")
+    if snapshot.power is None:
+        raise RuntimeError(f"power could not be read from {sampler.source}")
     
+    if snapshot.voltage is not None:
+        print(f"   ✅ Voltage: {snapshot.voltage/1_000_000:.2f} V")
+    if snapshot.current is not None:
+        print(f"   ✅ Current: {snapshot.current/1_000_000:.2f} A")
+    print(f"   ✅ Power: {snapshot.watts:.2f} W")
+    
+    if len(batteries) > 1:
+        group = monitor.SupplyGroupSampler(str(power_supply), supplies)
+        total = group.sample()
+        group.close()
+        print(f"   ✅ Total of {len(batteries)} batteries: {total.watts:.2f} W")
+        
 except Exception as e:
     print(f"   ❌ Error reading battery: {e}")
     exit(1)
 
-# Check for optional info
 print(f"\n3. Checking additional battery info...")
 
 for info_file in ["status", "capacity", "energy_now", "energy_full"]:
-    file_path = battery_path / info_file
-    if file_path.exists():
-        try:
-            with open(file_path) as f:
-                value = f.read().strip()
-            print(f"   ✅ {info_file}: {value}")
-        except:
-            pass
+    value = sampler.read_string(info_file)
+    if value is not None:
+        print(f"   ✅ {info_file}: {value}")
+
+sampler.close()
 
 # Check Python dependencies
 print("\n4. Checking Python dependencies...")
@@ -83,10 +108,12 @@ except Exception as e:
 
 # Check for notify-send
 print("\n5. Checking notification support...")
-if os.system("which notify-send > /dev/null 2>&1") == 0:
-    print("   ✅ notify-send available")
+if os.environ.get("DBUS_SESSION_BUS_ADDRESS"):
+    print("   ✅ Session bus available (notifications are sent over D-Bus)")
+elif os.system("which notify-send > /dev/null 2>&1") == 0:
+    print("   ✅ notify-send available (used without a session bus)")
 else:
-    print("   ⚠️  notify-send not found (optional)")
+    print("   ⚠️  No session bus and notify-send not found (optional)")
     print("   Install with: sudo apt install libnotify-bin")
 
 print("\n" + "=" * 50)
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Tests of the sampler and monitor core against fake power supply trees
+
+Run from the checkout with: python3 -m unittest test_monitor
+"""
+
+import copy
+import json
+import selectors
+import signal
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from script_loader import load_script
+
+monitor = load_script("battery-power-monitor.py", "battery-power-monitor")
+fake = load_script("fake-battery.py")
+
+# Everything a test run could write goes to the temporary directory
+QUIET_CONFIG = {
+    "power_log": {"enabled": False},
+    "energy_accounting": {"enabled": False},
+    "process_attribution": {"enabled": False},
+    "watch_uevents": False,
+}
+
+class FakeTreeTest(unittest.TestCase):
+    """A fresh fake tree per test, with the monitor's files kept out of HOME"""
+    
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        self.root = self.directory / "power_supply"
+        self.tree = fake.FakePowerSupplyTree(self.root)
+        
+        for name, value in (("POWER_SUPPLY_ROOT", str(self.root)),
+                            ("CONFIG_FILE", self.directory / "config.json"),
+                            ("LOG_DIR", self.directory / "log"),
+                            ("ENERGY_FILE", self.directory / "energy.json")):
+            patcher = mock.patch.object(monitor, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.write_config(QUIET_CONFIG)
+    
+    def write_config(self, config):
+        monitor.CONFIG_FILE.write_text(json.dumps(config))
+    
+    def sampler(self, name="BAT0"):
+        sampler = monitor.BatterySampler(str(self.root / name))
+        self.addCleanup(sampler.close)
+        return sampler
+
+class BatterySamplerTest(FakeTreeTest):
+    
+    def test_source_for_each_kind(self):
+        expected = {
+            "full": "power_now",
+            "power_now": "power_now",
+            "voltage_current": "voltage_current",
+            "energy": "energy_delta",
+            "charge": "charge_delta",
+        }
+        self.assertEqual(set(expected), set(fake.BATTERY_KINDS))
+        for kind, source in expected.items():
+            with self.subTest(kind=kind):
+                self.tree.add_battery("BAT0", kind, watts=6.0, volts=12.0)
+                sampler = self.sampler()
+                snapshot = sampler.sample()
+                self.assertEqual(sampler.source, source)
+                self.assertEqual(snapshot.status, "Discharging")
+                if source in ("power_now", "voltage_current"):
+                    self.assertEqual(snapshot.power, 6_000_000)
+                else:
+                    # Counters only give a rate once they have moved twice
+                    self.assertIsNone(snapshot.power)
+                    self.assertTrue(sampler.counts_energy)
+    
+    def test_missing_attributes(self):
+        self.tree.add_battery("BAT0", "full", watts=6.0, volts=12.0)
+        self.tree.remove_attribute("BAT0", "power_now")
+        sampler = self.sampler()
+        self.assertEqual(sampler.sample().power, 6_000_000)
+        self.assertEqual(sampler.source, "voltage_current")
+        
+        self.tree.remove_attribute("BAT0", "current_now")
+        self.tree.remove_attribute("BAT0", "capacity")
+        sampler = self.sampler()
+        snapshot = sampler.sample()
+        self.assertEqual(sampler.source, "energy_delta")
+        self.assertIsNone(snapshot.capacity)
+        
+        self.tree.add_battery("BAT0", "charge")
+        self.tree.remove_attribute("BAT0", "voltage_now")
+        sampler = self.sampler()
+        snapshot = sampler.sample()
+        self.assertIsNone(sampler.source)
+        self.assertIsNone(snapshot.power)
+        self.assertIsNone(snapshot.voltage)
+    
+    def sample_at(self, sampler, timestamp):
+        """Sample as if the wall clock read timestamp"""
+        with mock.patch.object(monitor.time, "time", return_value=timestamp):
+            return sampler.sample()
+    
+    def test_counter_rate_expires(self):
+        self.tree.add_battery("BAT0", "energy", watts=36.0)
+        sampler = self.sampler()
+        
+        # Baseline, first change (interval unknown), then 0.1 Wh in 10 s
+        self.assertIsNone(self.sample_at(sampler, 100.0).power)
+        self.tree.advance("BAT0", 10)
+        self.assertIsNone(self.sample_at(sampler, 110.0).power)
+        self.tree.advance("BAT0", 10)
+        self.assertAlmostEqual(self.sample_at(sampler, 120.0).power, 36_000_000, delta=1000)
+        
+        # Held while the counter stands still for up to twice the interval
+        self.assertIsNotNone(self.sample_at(sampler, 135.0).power)
+        self.assertIsNone(self.sample_at(sampler, 141.0).power)
+    
+    def test_status_change_resets_counter_rate(self):
+        self.tree.add_battery("BAT0", "energy", watts=36.0)
+        sampler = self.sampler()
+        for timestamp in (100.0, 110.0, 120.0):
+            snapshot = self.sample_at(sampler, timestamp)
+            self.tree.advance("BAT0", 10)
+        self.assertIsNotNone(snapshot.power)
+        
+        self.tree.set_power("BAT0", 20.0, status="Charging")
+        snapshot = self.sample_at(sampler, 125.0)
+        self.assertIsNone(snapshot.power)
+        self.assertEqual(snapshot.status, "Charging")
+        self.assertIsNone(self.sample_at(sampler, 126.0).power)
+    
+    def test_reopens_after_replug(self):
+        self.tree.add_battery("BAT0", "full", watts=6.0)
+        sampler = self.sampler()
+        self.assertEqual(sampler.sample().power, 6_000_000)
+        
+        # Unplugged and back between two readings: the old descriptors read
+        # the emptied files and are reopened on the new ones
+        self.tree.remove("BAT0")
+        self.tree.add_battery("BAT0", "full", watts=9.0)
+        self.assertEqual(sampler.sample().power, 9_000_000)
+        
+        self.tree.remove("BAT0")
+        snapshot = sampler.sample()
+        self.assertIsNone(snapshot.power)
+        self.assertIsNone(snapshot.status)
+        
+        self.tree.add_battery("BAT0", "full", watts=7.0)
+        with mock.patch.object(monitor.BatterySampler, "RETRY_INTERVAL", 0):
+            self.assertEqual(sampler.sample().power, 7_000_000)
+
+class SupplyGroupSamplerTest(FakeTreeTest):
+    
+    def test_totals_and_energy_weights(self):
+        self.tree.add_battery("BAT0", "full", watts=6.0, capacity=100, full_wh=50.0)
+        self.tree.add_battery("BAT1", "voltage_current", watts=4.0, volts=10.0, capacity=0, full_wh=20.0)
+        self.tree.add_adapter("AC", online=False)
+        self.tree.add_peripheral()
+        
+        supplies = monitor.discover_power_supplies()
+        self.assertEqual(supplies["hid-mouse-battery"], "Device")
+        sampler = monitor.SupplyGroupSampler(str(self.root), supplies)
+        self.addCleanup(sampler.close)
+        
+        # BAT1 only has charge_full (2 Ah at 10 V)
+        self.assertEqual(sampler.weights, {"BAT0": 50_000_000, "BAT1": 20_000_000})
+        snapshot = sampler.sample()
+        self.assertEqual(snapshot.power, 10_000_000)
+        self.assertEqual(snapshot.capacity, 71)
+        self.assertIs(snapshot.ac_online, False)
+        self.assertEqual([name for name, pack in snapshot.packs], ["BAT0", "BAT1"])
+
+class RediscoveryTest(FakeTreeTest):
+    
+    def setUp(self):
+        super().setUp()
+        # The daemon installs signal handlers of its own
+        for signum in (signal.SIGHUP, signal.SIGINT, signal.SIGTERM):
+            self.addCleanup(signal.signal, signum, signal.getsignal(signum))
+        
+        self.tree.add_battery("BAT0", "full", watts=6.0)
+        self.daemon = monitor.HeadlessMonitor(address="127.0.0.1", port=0)
+        self.addCleanup(self.daemon.close)
+        
+        # Listen to uevents from the fake tree instead of the kernel
+        self.daemon.uevents = monitor.FakeUeventSource()
+        self.daemon.selector.register(self.daemon.uevents, selectors.EVENT_READ, self.daemon.on_uevent)
+        self.tree.uevents = self.daemon.uevents
+    
+    def dispatch(self):
+        """Run the daemon's handlers for whatever is pending"""
+        for key, mask in self.daemon.selector.select(1):
+            key.data(key.fileobj)
+    
+    def test_add_and_remove_uevents(self):
+        self.daemon.update()
+        self.assertEqual(self.daemon.snapshot.power, 6_000_000)
+        
+        self.tree.add_battery("BAT1", "full", watts=3.0)
+        self.dispatch()
+        self.assertIn("BAT1", self.daemon.supplies)
+        self.daemon.update()
+        self.assertEqual(self.daemon.snapshot.power, 9_000_000)
+        
+        self.tree.remove("BAT0")
+        self.dispatch()
+        self.assertNotIn("BAT0", self.daemon.supplies)
+        self.daemon.update()
+        self.assertEqual(self.daemon.snapshot.power, 3_000_000)
+        self.assertEqual([name for name, pack in self.daemon.snapshot.packs], ["BAT1"])
+    
+    def test_change_uevent_keeps_sampler(self):
+        sampler = self.daemon.sampler
+        self.tree.set_power("BAT0", 8.0)
+        self.dispatch()
+        self.assertIs(self.daemon.sampler, sampler)
+
+class ValidateConfigTest(FakeTreeTest):
+    
+    def problems(self, **settings):
+        return monitor.validate_config(monitor.merge_config(settings))
+    
+    def test_defaults_are_valid(self):
+        self.assertEqual(monitor.validate_config(copy.deepcopy(monitor.CONFIG)), [])
+    
+    def test_rejections(self):
+        cases = {
+            "wrong type": {"show_voltage": 1},
+            "below limit": {"update_interval": 0},
+            "above limit": {"decimal_places": 7},
+            "fractional count": {"history_size": 100.0},
+            "nested fractional count": {"process_attribution": {"top": 5.0}},
+            "section not an object": {"power_log": True},
+            "rule not an object": {"alert_rules": ["power > 5"]},
+            "rule metric": {"alert_rules": [{"metric": "volts", "condition": ">", "value": 5}]},
+            "rule condition": {"alert_rules": [{"metric": "power", "condition": ">=", "value": 5}]},
+            "rule value": {"alert_rules": [{"metric": "power", "condition": ">", "value": "5"}]},
+            "rule status": {"alert_rules": [{"metric": "power", "condition": ">", "value": 5,
+                                             "status": 2}]},
+            "rule duration": {"alert_rules": [{"metric": "power", "condition": ">", "value": 5,
+                                               "duration": -1}]},
+        }
+        for case, settings in cases.items():
+            with self.subTest(case):
+                self.assertEqual(len(self.problems(**settings)), 1)
+        
+        rule = {"metric": "capacity", "condition": "<", "value": 15, "status": "Discharging"}
+        self.assertEqual(self.problems(alert_rules=[rule]), [])
+    
+    def test_invalid_file_falls_back(self):
+        self.tree.add_battery("BAT0")
+        self.write_config({**QUIET_CONFIG, "history_size": 0})
+        core = monitor.MonitorCore()
+        self.addCleanup(core.close)
+        self.assertEqual(core.config['history_size'], monitor.CONFIG['history_size'])
+        
+        # A reload with an invalid file keeps the running settings
+        self.write_config({**QUIET_CONFIG, "history_size": 100, "decimal_places": 2.0})
+        history = core.history
+        core.reload_config()
+        self.assertIs(core.history, history)
+        self.assertEqual(core.config['history_size'], monitor.CONFIG['history_size'])
+        
+        self.write_config({**QUIET_CONFIG, "history_size": 100})
+        core.reload_config()
+        self.assertEqual(core.config['history_size'], 100)
+        self.assertIsNot(core.history, history)
+
+if __name__ == "__main__":
+    unittest.main()